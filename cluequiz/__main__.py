@@ -15,27 +15,54 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import pygame
+from logging import INFO, WARNING, basicConfig
+from signal import SIGUSR1, signal
 from sys import argv
-from pygame.locals import FULLSCREEN, QUIT, KEYDOWN, K_ESCAPE
+from pygame.locals import FULLSCREEN, RESIZABLE, QUIT, KEYDOWN, K_ESCAPE
+from cluequiz.config import config
 from cluequiz.game import Game
+from cluequiz.latency import tracer
 from cluequiz.screen import Screen
 
+IDLE_TIMEOUT = 250 # ms
+
 def main():
+    if len(argv) > 1 and argv[1] == 'compile':
+        from cluequiz.compiler import main
+        return main(argv[2:])
+
+    basicConfig(level=config.log_level or (INFO if config.debug else WARNING))
     pygame.display.init()
     pygame.font.init()
     pygame.mixer.init() # devicename='PULSEAUDIO_DEVICE_DESCRIPTION'
-    pygame.display.set_mode((0, 0), FULLSCREEN)
+    pygame.display.set_mode((0, 0), FULLSCREEN | RESIZABLE)
     instance = Game(None if len(argv) < 2 else argv[1])
     screen = Screen(instance)
 
+    signal(SIGUSR1, lambda signum, frame: tracer.dump())
+
+    clock = pygame.time.Clock()
+    fps = config.render.fps
+    idle = config.render.idle
+
     while True:
-        for event in pygame.event.get():
+        events = pygame.event.get()
+        if idle and len(events) == 0 and screen.is_idle():
+            # Nothing changes on its own, so sleep until there is input
+            events = [pygame.event.wait(IDLE_TIMEOUT)] + pygame.event.get()
+
+        for event in events:
             if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+                tracer.dump()
+                instance.journal.close()
                 return
             else:
                 screen.handle(event, instance)
-        screen.update(instance)
-        pygame.display.flip()
+        dirty = screen.update(instance)
+        if dirty:
+            pygame.display.update(dirty)
+            tracer.flipped()
+        clock.tick(fps)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,149 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from pygame.locals import NUMEVENTS, USEREVENT
+from collections import OrderedDict, namedtuple
+from logging import getLogger
+from threading import Lock
+
+from cluequiz.config import config
+from cluequiz.sound import StreamedSound
+
+ASSETSREADY = USEREVENT + (43 % (NUMEVENTS-USEREVENT))
+
+logger = getLogger(__name__)
+
+# A lazily loaded clue or question; load takes no arguments and returns a Surface or Sound
+Asset = namedtuple('Asset', ['kind', 'load'])
+
+
+def sizeof(value):
+    """Estimate the number of bytes held by a decoded surface or sound."""
+    if isinstance(value, StreamedSound):
+        return 0
+    if isinstance(value, pygame.mixer.Sound):
+        freq, fmt, channels = pygame.mixer.get_init()
+        return int(value.get_length() * freq) * channels * (abs(fmt) // 8)
+    return value.get_pitch() * value.get_height()
+
+
+class AssetStore:
+    """Materializes assets on first use and evicts the least recently used ones.
+
+    All loading happens on the given executor, so assets are never rendered
+    from two threads at once. Assets loaded for a generation which has been
+    cleared since are not stored. Assets which cannot be loaded are
+    replaced by placeholder, so a broken file never stops the game.
+    """
+
+    def __init__(self, executor, budget, placeholder):
+        self.executor = executor
+        self.budget = budget
+        self.placeholder = placeholder
+        self.lock = Lock()
+        self.loaded = OrderedDict()
+        self.pending = {}
+        self.held = 0
+        self.generation = 0
+
+    def get(self, asset):
+        """Return the materialized asset, loading it if necessary."""
+        with self.lock:
+            if asset in self.loaded:
+                self.loaded.move_to_end(asset)
+                return self.loaded[asset][0]
+            future = self.pending.get(asset)
+            if future is None:
+                future = self.pending[asset] = self.executor.submit(self.materialize, asset, self.generation)
+        return future.result()
+
+    def put(self, asset, value):
+        """Add an asset which has already been materialized."""
+        self.store(asset, value)
+
+    def reload(self, kinds):
+        """Materialize loaded assets of the given kinds again in the background.
+
+        The current values are returned by get until the new ones are ready;
+        ASSETSREADY is posted for each replaced asset.
+        """
+        with self.lock:
+            for asset in self.loaded:
+                if asset.kind in kinds and asset not in self.pending:
+                    self.pending[asset] = self.executor.submit(self.materialize, asset, self.generation, True)
+
+    def prefetch(self, assets):
+        """Queue assets which are likely to be needed soon."""
+        with self.lock:
+            for asset in assets:
+                if asset not in self.loaded and asset not in self.pending:
+                    self.pending[asset] = self.executor.submit(self.materialize, asset, self.generation)
+
+    def materialize(self, asset, generation, reloading=False):
+        try:
+            value = asset.load()
+            failed = False
+        except Exception as e:
+            logger.error('Could not load %s clue: %s', asset.kind, e)
+            value = self.placeholder
+            failed = True
+        finally:
+            with self.lock:
+                current = generation == self.generation
+                if current:
+                    del self.pending[asset]
+        if not current:
+            return value
+        if failed and reloading:
+            # Keep showing the version loaded before
+            return value
+        self.store(asset, value)
+        if reloading:
+            pygame.event.post(pygame.event.Event(ASSETSREADY, { 'asset': asset }))
+        if config.debug:
+            print('assets', self.usage())
+        return value
+
+    def store(self, asset, value):
+        size = sizeof(value)
+        with self.lock:
+            if asset in self.loaded:
+                self.held = self.held - self.loaded[asset][1]
+            self.loaded[asset] = (value, size)
+            self.loaded.move_to_end(asset)
+            self.held = self.held + size
+            while self.held > self.budget and len(self.loaded) > 1:
+                _, (_, evicted) = self.loaded.popitem(last=False)
+                self.held = self.held - evicted
+
+    def clear(self):
+        """Drop all assets and the loads which have not started yet."""
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.generation = self.generation + 1
+            self.loaded.clear()
+            self.held = 0
+
+    def usage(self):
+        """Bytes currently held per asset kind."""
+        usage = {}
+        with self.lock:
+            for asset, (_, size) in self.loaded.items():
+                usage[asset.kind] = usage.get(asset.kind, 0) + size
+        return usage
@@ -0,0 +1,177 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from cluequiz.config import config
+from copy import deepcopy
+from json import dumps
+from logging import getLogger
+from os import remove
+from os.path import exists
+from paho.mqtt.client import Client
+from queue import SimpleQueue
+from threading import Thread
+import socket
+
+logger = getLogger(__name__)
+
+# Sockets which do not take a message within this many seconds are dropped
+SEND_TIMEOUT = 1
+
+
+def set_field(state, field, index, value):
+    if field == 'board':
+        state['board'][index[0]][index[1]] = value
+    elif index == None:
+        state[field] = value
+    else:
+        state[field][index] = value
+
+
+class SocketTransport:
+    """Sends one JSON message per line to every client of a listening socket."""
+
+    def __init__(self, server):
+        self.server = server
+        self.clients = []
+
+    def start(self, connected):
+        Thread(target=self.accept, args=(connected,), name='broadcast-accept', daemon=True).start()
+
+    def accept(self, connected):
+        while True:
+            client, _ = self.server.accept()
+            client.settimeout(SEND_TIMEOUT)
+            connected(self, client)
+
+    def write(self, client, message):
+        try:
+            client.sendall(message.encode() + b'\n')
+            return True
+        except OSError as e:
+            logger.info('Dropping spectator: %s', e)
+            client.close()
+            return False
+
+    def connected(self, client, snapshot):
+        if self.write(client, snapshot):
+            self.clients.append(client)
+
+    def send(self, message):
+        self.clients = [client for client in self.clients if self.write(client, message)]
+
+    def refresh(self, snapshot):
+        pass
+
+
+class MqttTransport:
+    """Publishes deltas to topic/delta and keeps a retained snapshot in topic/snapshot."""
+
+    def __init__(self, host, port, topic, qos):
+        self.topic = topic
+        self.qos = qos
+        self.client = Client()
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.host = host
+        self.port = port
+
+    def start(self, connected):
+        def on_connect(client, userdata, flags, rc):
+            if rc == 0:
+                connected(self, None)
+
+        self.client.on_connect = on_connect
+        self.client.connect_async(self.host, self.port)
+        self.client.loop_start()
+
+    def connected(self, client, snapshot):
+        # Deltas sent while disconnected are lost, so clients have to resync
+        self.refresh(snapshot)
+
+    def send(self, message):
+        self.client.publish(self.topic + '/delta', message, qos=self.qos)
+
+    def refresh(self, snapshot):
+        self.client.publish(self.topic + '/snapshot', snapshot, qos=self.qos, retain=True)
+
+
+class Broadcaster:
+    """Mirrors the game to spectators as a snapshot followed by numbered deltas.
+
+    Changes are collected with set and sent as one delta by flush. Clients get
+    a snapshot when they connect. A delta is a list of [field, index, value]
+    changes to apply to the snapshot; if a sequence number is missing, the
+    client has to get a new snapshot. Messages are sent from a background
+    thread, which also keeps the mirrored state.
+    """
+
+    def __init__(self, state, transports, interval):
+        self.transports = transports
+        self.interval = interval
+        self.pending = []
+        if len(transports) == 0:
+            return
+
+        self.queue = SimpleQueue()
+        Thread(target=self.run, args=(deepcopy(state),), name='broadcast', daemon=True).start()
+        for transport in transports:
+            transport.start(lambda transport, client: self.queue.put((transport, client)))
+
+    def set(self, field, index, value):
+        if self.transports:
+            self.pending.append([field, index, value])
+
+    def flush(self):
+        """Send the changes since the last flush, called once per frame."""
+        if self.pending:
+            self.queue.put((None, self.pending))
+            self.pending = []
+
+    def run(self, state):
+        seq = 0
+        while True:
+            transport, data = self.queue.get()
+            if transport != None:
+                transport.connected(data, dumps({ 'type': 'snapshot', 'seq': seq, 'state': state }))
+                continue
+
+            seq = seq + 1
+            for field, index, value in data:
+                set_field(state, field, index, value)
+            message = dumps({ 'type': 'delta', 'seq': seq, 'set': data })
+            for transport in self.transports:
+                transport.send(message)
+            if seq % self.interval == 0:
+                snapshot = dumps({ 'type': 'snapshot', 'seq': seq, 'state': state })
+                for transport in self.transports:
+                    transport.refresh(snapshot)
+
+
+def create_broadcaster(state):
+    """Set up the transports configured in broadcast."""
+    broadcast = config.broadcast
+    transports = []
+    if broadcast.host:
+        transports.append(SocketTransport(socket.create_server((broadcast.host, broadcast.port))))
+    if broadcast.socket:
+        if exists(broadcast.socket):
+            remove(broadcast.socket)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(broadcast.socket)
+        server.listen()
+        transports.append(SocketTransport(server))
+    if broadcast.mqtt_topic and config.mqtt.host:
+        transports.append(MqttTransport(config.mqtt.host, config.mqtt.port, broadcast.mqtt_topic, config.mqtt.qos))
+    return Broadcaster(state, transports, broadcast.snapshot_interval)
@@ -0,0 +1,183 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from io import BytesIO
+from json import dumps, loads
+from logging import getLogger
+from mmap import ACCESS_READ, mmap
+from os import fstat, fsync, remove, replace, stat
+from os.path import join
+from pygame.locals import SRCALPHA
+from struct import Struct
+
+from cluequiz.cache import STYLE
+from cluequiz.sound import StreamedSound
+
+logger = getLogger(__name__)
+
+SUFFIX = '.cqb'
+MAGIC = b'CQB\0'
+VERSION = 1
+# Magic, version, offset and length of the index
+HEADER = Struct('<4sIQQ')
+# Blobs start at multiples of this, so pixel rows of the mapped file are aligned
+ALIGNMENT = 64
+
+
+def is_bundle(path):
+    return path.endswith(SUFFIX)
+
+
+class Bundle:
+    """A compiled clue set, memory-mapped and read in place.
+
+    The file starts with HEADER, followed by the blobs and a JSON index:
+
+    * clue-set: the clue set as a list of [category, clues]
+    * style, size, mixer: what the bundle was compiled for
+    * surfaces: [offset, length, format, width, height] of the raw pixels
+      by the repr of the key the surface is cached under
+    * sounds: [offset, length] of PCM in the mixer format by file name
+    * files: [offset, length] of the original image and sound files
+
+    The original files are used if the bundle was compiled for another
+    display size or mixer format.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # The file stays open, so blob can tell whether it has been cut short
+        self.file = open(path, 'rb')
+        self.stat = fstat(self.file.fileno())
+        self.map = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, version, offset, length = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError('%s is not a clue set bundle' % path)
+        if version != VERSION:
+            raise ValueError('%s has bundle version %d instead of %d, compile it again' % (path, version, VERSION))
+        index = loads(bytes(self.view[offset:offset+length]))
+
+        self.clue_set = index['clue-set']
+        self.size = tuple(index['size'])
+        self.mixer = tuple(index['mixer'])
+        self.files = index['files']
+        self.sounds = index['sounds']
+        self.surfaces = index['surfaces']
+        # Surfaces rendered with another style or pygame version look different
+        if index['style'] != repr(STYLE):
+            logger.warning('%s was compiled with another style or pygame version, its clues are rendered again', path)
+            self.surfaces = {}
+        if self.mixer != pygame.mixer.get_init():
+            logger.warning('%s was compiled for the mixer format %s, its sounds are decoded again', path, self.mixer)
+            self.sounds = {}
+
+    def replaced(self):
+        """Whether the file has changed since it was mapped."""
+        try:
+            s = stat(self.path)
+        except OSError:
+            return False
+        return (s.st_ino, s.st_mtime_ns) != (self.stat.st_ino, self.stat.st_mtime_ns)
+
+    def refresh(self):
+        """Map the file again if it has been replaced or overwritten since it was mapped."""
+        if self.replaced():
+            # Only taken over once the new file could be read completely
+            self.__dict__.update(Bundle(self.path).__dict__)
+
+    def blob(self, entry):
+        # Reading pages past the end of a file overwritten in place would crash with SIGBUS
+        if entry[0] + entry[1] > fstat(self.file.fileno()).st_size:
+            raise OSError('%s has been cut short, it is probably being overwritten' % self.path)
+        return self.view[entry[0]:entry[0]+entry[1]]
+
+    def surface(self, key):
+        """The surface stored under key (as used by SurfaceCache), or None."""
+        self.refresh()
+        entry = self.surfaces.get(repr(key))
+        if entry is None:
+            return None
+        return pygame.image.frombuffer(self.blob(entry), (entry[3], entry[4]), entry[2])
+
+    def sound(self, name, threshold):
+        """Play PCM straight from the bundle, stream sounds larger than threshold bytes."""
+        self.refresh()
+        if name in self.sounds:
+            return pygame.mixer.Sound(buffer=self.blob(self.sounds[name]))
+        data = self.blob(self.files[name])
+        if len(data) > threshold:
+            return StreamedSound(join(self.path, name), data)
+        return pygame.mixer.Sound(file=BytesIO(data))
+
+    def open(self, name):
+        """A file object with the contents of an embedded file."""
+        self.refresh()
+        return BytesIO(self.blob(self.files[name]))
+
+
+class BundleWriter:
+    """Writes a bundle to path + '.tmp' and moves it to path once it is complete."""
+
+    def __init__(self, path, clue_set, size):
+        self.path = path
+        self.file = open(path + '.tmp', 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        self.index = {
+            'clue-set': clue_set,
+            'style': repr(STYLE),
+            'size': list(size),
+            'mixer': list(pygame.mixer.get_init()),
+            'surfaces': {},
+            'sounds': {},
+            'files': {},
+        }
+
+    def write(self, data):
+        offset = -self.file.tell() % ALIGNMENT
+        self.file.write(bytes(offset))
+        offset = self.file.tell()
+        self.file.write(data)
+        return [offset, len(data)]
+
+    def add_surface(self, key, surface):
+        fmt = 'RGBA' if surface.get_flags() & SRCALPHA else 'RGB'
+        entry = self.write(pygame.image.tostring(surface, fmt))
+        self.index['surfaces'][repr(key)] = entry + [fmt, surface.get_width(), surface.get_height()]
+
+    def add_sound(self, name, sound):
+        if name not in self.index['sounds']:
+            self.index['sounds'][name] = self.write(sound.get_raw())
+
+    def add_file(self, name, path):
+        if name not in self.index['files']:
+            with open(path, 'rb') as f:
+                self.index['files'][name] = self.write(f.read())
+
+    def close(self):
+        index = self.write(dumps(self.index).encode())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, *index))
+        self.file.flush()
+        fsync(self.file.fileno())
+        self.file.close()
+        replace(self.path + '.tmp', self.path)
+
+    def abort(self):
+        self.file.close()
+        remove(self.path + '.tmp')
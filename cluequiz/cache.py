@@ -0,0 +1,92 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from hashlib import sha256
+from os import environ, makedirs, replace
+from os.path import expanduser, join
+from pygame.locals import SRCALPHA
+from struct import Struct, error as StructError
+
+from cluequiz.config import config
+from cluequiz.style import *
+
+VERSION = 1
+HEADER = Struct('<4sII')
+
+# Everything besides the key itself that influences how a surface looks
+STYLE = (VERSION, pygame.version.ver, FONT_PATH, FONT_SIZE, BIGFONT_PATH, BIGFONT_SIZE, MIN_FONT_SIZE, TEXT_COLOR, CODE_STYLE)
+
+
+def default_directory():
+    return join(environ.get('XDG_CACHE_HOME', expanduser('~/.cache')), 'cluequiz')
+
+
+def digest(path):
+    h = sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SurfaceCache:
+    """Stores rendered surfaces as raw pixel buffers on disk."""
+
+    def __init__(self, directory):
+        self.directory = expanduser(directory)
+        makedirs(self.directory, exist_ok=True)
+
+    def path(self, key, sources):
+        h = sha256(repr((STYLE, key)).encode())
+        for source in sources:
+            h.update(digest(source).encode())
+        return join(self.directory, h.hexdigest())
+
+    def get(self, key, render, sources=()):
+        """Return the cached surface for key, rendering and storing it on a miss.
+
+        The contents of the files in sources are part of the key.
+        """
+        path = self.path(key, sources)
+        surface = self.read(path)
+        if surface is None:
+            surface = render()
+            self.write(path, surface)
+        return surface
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                fmt, w, h = HEADER.unpack(f.read(HEADER.size))
+                return pygame.image.fromstring(f.read(), (w, h), fmt.rstrip(b'\0').decode())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, StructError, pygame.error) as e:
+            if config.debug:
+                print('Could not read cached surface', path, e)
+            return None
+
+    def write(self, path, surface):
+        fmt = 'RGBA' if surface.get_flags() & SRCALPHA else 'RGB'
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(HEADER.pack(fmt.encode(), surface.get_width(), surface.get_height()))
+                f.write(pygame.image.tostring(surface, fmt))
+            replace(path + '.tmp', path)
+        except OSError as e:
+            if config.debug:
+                print('Could not cache surface', path, e)
@@ -0,0 +1,96 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compile a clue set into a single bundle file.
+
+    cluequiz compile clue-set.yml [--output clue-set.cqb] [--size 1920x1080]
+
+All clues, questions and categories are rendered for the display size and
+the board of config.yml, sounds are decoded to PCM for the mixer. Bundles
+are used like the YAML files in clue-sets.
+"""
+
+import argparse
+import pygame
+from os import environ
+from os.path import getsize, splitext
+
+from cluequiz.bundle import SUFFIX, BundleWriter
+from cluequiz.render import ClueRenderer, clue_size
+
+
+class RecordingCache:
+    """Adds every surface rendered through the on-disk cache (if any) to a bundle."""
+
+    def __init__(self, cache, writer):
+        self.cache = cache
+        self.writer = writer
+
+    def get(self, key, render, sources=()):
+        surface = render() if self.cache is None else self.cache.get(key, render, sources)
+        self.writer.add_surface(key, surface)
+        return surface
+
+
+def compile_clue_set(yml, output, size):
+    """Check that every clue of yml can be loaded and write them to output."""
+    renderer = ClueRenderer(clue_size(size))
+    names, sources = renderer.parse_clue_set(yml)
+    writer = BundleWriter(output, [[name, cs] for name, cs in zip(names, sources)], size)
+    renderer.cache = RecordingCache(renderer.cache, writer)
+    try:
+        for x, name in enumerate(names):
+            renderer.category_asset(yml, name).load()
+            for o in sources[x]:
+                path = renderer.clue_file(yml, o)
+                if 'sound' in o:
+                    writer.add_file(o['sound'], path)
+                    if getsize(path) <= renderer.stream_threshold:
+                        writer.add_sound(o['sound'], pygame.mixer.Sound(path))
+                else:
+                    if 'image' in o:
+                        writer.add_file(o['image'], path)
+                    renderer.clue_asset(yml, o).load()
+                renderer.question_asset(yml, o).load()
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='cluequiz compile', description='Compile a clue set into a single bundle file.')
+    parser.add_argument('clue_set', help='the clue set to compile')
+    parser.add_argument('--output', help='the bundle to write (default: the clue set with the suffix %s)' % SUFFIX)
+    parser.add_argument('--size', default='1920x1080', help='display size of the show, e.g. 1280x720')
+    args = parser.parse_args(argv)
+
+    environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.font.init()
+    pygame.mixer.init()
+    size = tuple(int(v) for v in args.size.split('x'))
+    # Surfaces are converted to the pixel format of the display
+    pygame.display.set_mode(size)
+
+    output = args.output or splitext(args.clue_set)[0] + SUFFIX
+    try:
+        compile_clue_set(args.clue_set, output, size)
+    except Exception as e:
+        # Anything that fails here would fail during the show
+        raise SystemExit('Could not compile %s: %s' % (args.clue_set, e))
+    print('Wrote', output)
@@ -14,51 +14,159 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections import namedtuple
 from os import environ
-from yaml import Loader, load
+from yaml import load
 
+from cluequiz.helper import YamlLoader
 
-class Config():
-    """Loads configuration from environment variables."""
-    UNSET = object()
+REQUIRED = object()
+NUMBER = (int, float)
+# Keys which may be null although their default is not
+NULLABLE = {'serial.port'}
+# Keys which only take some values
+CHOICES = {'serial.protocol': ('bytes', 'framed')}
+# Players are numbered by the keys 1 to 9
+MAX_PLAYERS = 9
 
-    def __init__(self):
-        self.config_file = environ.get('CONFIG_FILE', 'config.yml')
-        with open(self.config_file) as f:
-            self.config = load(f, Loader)
+# Type and default of every configuration key, sections are nested dicts
+SCHEMA = {
+    'clue-sets': (list, REQUIRED),
+    'debug': (bool, False),
+    'viewer': (bool, False),
+    'ignore-responded': (bool, False),
+    'undo-depth': (int, 100),
+    'log-level': ((str, int), None),
+    'players': (int, 4),
+    'music': ((str, list), None),
+    'cache': ((str, bool), True),
+    'assets': {
+        'budget': (NUMBER, 256),
+    },
+    'autosave': {
+        'path': (str, 'autosave.yml'),
+        'compact': (int, 100),
+    },
+    'broadcast': {
+        'host': (str, None),
+        'port': (int, 4242),
+        'socket': (str, None),
+        'mqtt-topic': (str, None),
+        'snapshot-interval': (int, 100),
+    },
+    'board': {
+        'columns': (int, 6),
+        'rows': (int, 5),
+    },
+    'input': {
+        'tie-window': (NUMBER, 0),
+    },
+    'mqtt': {
+        'host': (str, None),
+        'port': (int, 1883),
+        'topic': (str, 'cluequiz'),
+        'qos': (int, 0),
+        'queue-size': (int, 100),
+        'spool': (str, None),
+        'spool-size': (NUMBER, 1024),
+        'spool-expiry': (NUMBER, 3600),
+    },
+    'mqtt_input': {
+        'certfile': (str, REQUIRED),
+        'keyfile': (str, REQUIRED),
+        'host': (str, REQUIRED),
+        'port': (int, 8883),
+    },
+    'render': {
+        'fps': (int, 60),
+        'idle': (bool, True),
+    },
+    'serial': {
+        'port': (str, '/dev/ttyUSB0'),
+        'baud': (int, 9600),
+        'protocol': (str, 'bytes'),
+    },
+    'sound': {
+        'stream-threshold': (NUMBER, 1024),
+    },
+}
 
-        if 'DEBUG' in environ:
-            self.config['debug'] = environ.get('DEBUG', 'False') in ['True', 'true', 'yes', 'y']
-        if 'VIEWER' in environ:
-            self.config['viewer'] = environ.get('VIEWER', 'False') in ['True', 'true', 'yes', 'y']
 
-        print(self.config)
+def attribute(key):
+    return key.replace('-', '_')
 
-    def __call__(self, key, default=UNSET):
-        """Query for a configuration variable."""
-        if key == 'debug':
-            return self.debug
-        try:
-            return self._resolve(key, self.config)
-        except KeyError as _:
-            if default is self.UNSET:
-                raise SystemExit('Required config key "%s" is missing' % key)
-            return default
 
-    def _resolve(self, key, search_dict):
-        """Get items and subitems from dict using 'key.subkey'."""
-        if '.' in key:
-            key, sub_key = key.split('.', 1)
-            return self._resolve(sub_key, search_dict[key])
-        return search_dict[key]
+def has_type(value, types):
+    """Like isinstance, but booleans are no numbers."""
+    if isinstance(value, bool):
+        return types is bool or (isinstance(types, tuple) and bool in types)
+    return isinstance(value, types)
 
-    @property
-    def debug(self):
-        return self.config.get('debug', False)
 
-    @property
-    def viewer(self):
-        return self.config.get('viewer', False)
+def freeze(schema, values, path=''):
+    """Check values against schema and turn them into nested namedtuples.
 
+    Sections get an additional configured attribute telling whether they were
+    present in the config file. Sections with required keys are None if absent.
+    """
+    for key in values:
+        if key not in schema:
+            print('Ignoring unknown config key "%s%s"' % (path, key))
 
-config = Config()
+    fields = {}
+    for key, spec in schema.items():
+        if isinstance(spec, dict):
+            section = values.get(key)
+            if section == None:
+                required = any(not isinstance(s, dict) and s[1] is REQUIRED for s in spec.values())
+                fields[attribute(key)] = None if required else freeze(spec, {}, path+key+'.')._replace(configured=False)
+            elif not isinstance(section, dict):
+                raise SystemExit('Config key "%s%s" must be a mapping' % (path, key))
+            else:
+                fields[attribute(key)] = freeze(spec, section, path+key+'.')
+            continue
+
+        types, default = spec
+        if key not in values:
+            if default is REQUIRED:
+                raise SystemExit('Required config key "%s%s" is missing' % (path, key))
+            fields[attribute(key)] = default
+        elif values[key] is None:
+            if default != None and path+key not in NULLABLE:
+                raise SystemExit('Config key "%s%s" must not be null' % (path, key))
+            fields[attribute(key)] = None
+        elif not has_type(values[key], types):
+            raise SystemExit('Config key "%s%s" has the wrong type' % (path, key))
+        elif path+key in CHOICES and values[key] not in CHOICES[path+key]:
+            raise SystemExit('Config key "%s%s" must be one of %s' % (path, key, ', '.join(CHOICES[path+key])))
+        else:
+            fields[attribute(key)] = values[key]
+    fields['configured'] = True
+
+    return namedtuple('Config', fields.keys())(**fields)
+
+
+def load_config():
+    """Load and check the configuration, CONFIG_FILE defaults to config.yml."""
+    config_file = environ.get('CONFIG_FILE', 'config.yml')
+    with open(config_file) as f:
+        values = load(f, YamlLoader) or {}
+
+    if 'DEBUG' in environ:
+        values['debug'] = environ.get('DEBUG', 'False') in ['True', 'true', 'yes', 'y']
+    if 'VIEWER' in environ:
+        values['viewer'] = environ.get('VIEWER', 'False') in ['True', 'true', 'yes', 'y']
+
+    config = freeze(SCHEMA, values)
+    if config.players < 1 or config.players > MAX_PLAYERS:
+        raise SystemExit('Config key "players" must be between 1 and %d' % MAX_PLAYERS)
+    if config.board.columns < 1 or config.board.rows < 1:
+        raise SystemExit('The board needs at least one column and one row')
+    if config.broadcast.snapshot_interval < 1:
+        raise SystemExit('Config key "broadcast.snapshot-interval" must be at least 1')
+    if config.debug:
+        print(config)
+    return config
+
+
+config = load_config()
@@ -14,48 +14,59 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from copy import deepcopy
-from yaml import Loader, dump, load
+from collections import deque
 
-from cluequiz.helper import GameStateHistory, logger
+from cluequiz.broadcast import create_broadcaster
+from cluequiz.helper import Change, HistoryEntry, logger
 from cluequiz.config import config
 from cluequiz.mqtt import publish_event
+from cluequiz.save import Journal, dump_entry, load_entry, load_save
 
 class Game:
     def __init__(self, save):
-        self.history = []
-        self.clue_sets = config('clue-sets')
+        self.undo_history = deque(maxlen=config.undo_depth)
+        self.redo_history = []
+        self.changes = []
+        self.clue_sets = config.clue_sets
         if len(self.clue_sets) == 0:
             raise ValueError('At least one complete clue set is needed')
         self.next = 0
 
-        self.state = []
-        for i in range(6):
-            self.state.append([ None, None, None, None, None ])
+        self.columns = config.board.columns
+        self.rows = config.board.rows
+        self.players = config.players
+        self.reset()
+
+        seq = 0
+        if save:
+            s = load_save(save, config.undo_depth)
+            if len(s['board']) != self.columns or any(len(column) != self.rows for column in s['board']):
+                raise ValueError('Serialized board state must have %d columns of %d rows' % (self.columns, self.rows))
+            if len(s['scores']) != self.players:
+                raise ValueError('There have to be exactly %d score values' % self.players)
+            if len(s['names']) != self.players:
+                raise ValueError('There have to be exactly %d player names' % self.players)
+            self.board = [v for column in s['board'] for v in column]
+            self.remaining = self.board.count(None)
+            self.scores = s['scores']
+            self.names = s['names']
+            self.choosing = s['choosing']
+            self.undo_history.extend(load_entry(e) for e in s['undo'])
+            self.redo_history = [load_entry(e) for e in s['redo']]
+            seq = s['seq']
+        self.journal = Journal(config.autosave.path, config.autosave.compact, config.undo_depth, self.serialize(), seq)
+        self.broadcast = create_broadcaster(self.spectator_state())
+
+    def reset(self):
+        # The board is stored column by column, remaining counts the unrevealed clues
+        self.board = [None] * (self.columns * self.rows)
+        self.remaining = len(self.board)
         self.sel = None
-        self.scores = [ 0, 0, 0, 0 ]
-        self.names = ['Nameless #'+str(i+1) for i in range(4)]
+        self.scores = [0] * self.players
+        self.names = ['Nameless #'+str(i+1) for i in range(self.players)]
         self.choosing = 0
         self.responding = None
-        self.responded = [ False, False, False, False ]
-
-        if save:
-            with open(save, 'r') as f:
-                s = load(f, Loader)
-                if len(s['board']) != 6:
-                    raise ValueError('Serialized board state must have six columns')
-                for r in s['board']:
-                    if len(r) != 5:
-                        raise ValueError('Serialized board state must have five rows')
-                if len(s['scores']) != 4:
-                    raise ValueError('There have to be exactly four score values')
-                if len(s['names']) != 4:
-                    raise ValueError('There have to be exactly four player names')
-                self.state = s['board']
-                self.scores = s['scores']
-                self.names = s['names']
-                self.choosing = s['choosing']
-        self.append_history()
+        self.responded = [False] * self.players
 
     def next_clue_set(self):
         clues = self.clue_sets[self.next]
@@ -64,37 +75,62 @@ class Game:
             self.next = 0
         return clues
 
+    def peek_clue_set(self):
+        return self.clue_sets[self.next]
+
     def get_state_at(self, x, y):
-        return self.state[x][y]
+        return self.board[x * self.rows + y]
+
+    def get_field(self, field, index):
+        if field == 'board':
+            return self.get_state_at(index[0], index[1])
+        elif field == 'choosing':
+            return self.choosing
+        return getattr(self, field)[index]
+
+    def set_field(self, field, index, value):
+        if field == 'board':
+            i = index[0] * self.rows + index[1]
+            self.remaining = self.remaining + (value == None) - (self.board[i] == None)
+            self.board[i] = value
+        elif field == 'choosing':
+            self.choosing = value
+        else:
+            getattr(self, field)[index] = value
+        if field != 'responded':
+            self.broadcast.set(field, index, value)
+
+    def change(self, field, index, value):
+        """Change a part of the game state, to be committed by save_state."""
+        self.changes.append(Change(field, index, self.get_field(field, index), value))
+        self.set_field(field, index, value)
 
     def ignore_clue(self):
-        self.state[self.sel[0]][self.sel[1]] = -1
-        self.save_state()
+        self.change('board', list(self.sel), -1)
+        self.save_state('ignore')
 
     def finished(self):
-        for s in self.state:
-            if None in s:
-                return False
-        return True
+        return self.remaining == 0
 
     def set_selected(self, x, y):
         self.sel = (x, y)
+        self.broadcast.set('selected', None, [x, y])
         publish_event('select', self.choosing, (y+1) * 100)
 
     def get_selected(self):
         return self.sel
 
     def correct(self):
-        self.state[self.sel[0]][self.sel[1]] = self.responding
-        self.scores[self.responding] = self.scores[self.responding] + (self.sel[1]+1) * 100
-        self.choosing = self.responding
-        self.save_state()
+        self.change('board', list(self.sel), self.responding)
+        self.change('scores', self.responding, self.scores[self.responding] + (self.sel[1]+1) * 100)
+        self.change('choosing', None, self.responding)
+        self.save_state('correct')
 
         publish_event('correct', self.responding, (self.sel[1]+1) * 100)
 
     def wrong(self):
-        self.scores[self.responding] = self.scores[self.responding] - (self.sel[1]+1) * 100
-        self.save_state()
+        self.change('scores', self.responding, self.scores[self.responding] - (self.sel[1]+1) * 100)
+        self.save_state('wrong')
 
         publish_event('wrong', self.responding, (self.sel[1]+1) * 100)
 
@@ -103,6 +139,8 @@ class Game:
 
     def set_name(self, i, name):
         self.names[i] = name
+        self.broadcast.set('names', i, name)
+        self.journal.record('name', [('names', i, name)])
 
     def get_name(self, i):
         return self.names[i]
@@ -110,10 +148,15 @@ class Game:
     def get_choosing(self):
         return self.choosing
 
+    def may_respond(self, i):
+        return config.ignore_responded or not self.responded[i]
+
     def set_responding(self, i):
-        if config('ignore-responded', False) or not self.responded[i]:
+        if self.may_respond(i):
             self.responding = i
-            self.responded[i] = True
+            self.broadcast.set('responding', None, i)
+            # Committed with the next action, so undoing it lets the player respond again
+            self.change('responded', i, True)
 
             publish_event('respond', i, (self.sel[1]+1) * 100)
             return True
@@ -123,59 +166,86 @@ class Game:
         return self.responding
 
     def all_responded(self):
-        if config('ignore-responded', False):
+        if config.ignore_responded:
             return False
         return not (False in self.responded)
 
     def clear_responded(self):
-        self.responded = [ False, False, False, False ]
+        self.responded = [False] * self.players
+        self.changes = [c for c in self.changes if c.field != 'responded']
+        self.broadcast.set('responding', None, None)
 
     def clear(self):
-        self.history = []
-        self.state = []
-        for i in range(6):
-            self.state.append([ None, None, None, None, None ])
-        self.sel = None
-        self.scores = [ 0, 0, 0, 0 ]
-        self.names = ['Nameless #'+str(i+1) for i in range(4)]
-        self.choosing = 0
-        self.responding = None
-        self.responded = [ False, False, False, False ]
-        self.save_state()
-
-    def save_state(self):
-        self.append_history()
-        with open('autosave.yml', 'w') as f:
-            f.write(dump({
-                'board': self.state,
-                'scores': self.scores,
-                'names': self.names,
-                'choosing': self.choosing
-            }))
-
-    def append_history(self):
-        """Append current game state to history."""
-        history_entry = GameStateHistory(
-            state=deepcopy(self.state),
-            scores=deepcopy(self.scores),
-            choosing=deepcopy(self.choosing),
-            responded=deepcopy(self.responded),
-        )
-        self.history.append(history_entry)
+        self.undo_history.clear()
+        self.redo_history = []
+        self.changes = []
+        self.reset()
+
+        values = [('board', [x, y], None) for x in range(self.columns) for y in range(self.rows)]
+        values.extend(('scores', i, v) for i, v in enumerate(self.scores))
+        values.extend(('names', i, v) for i, v in enumerate(self.names))
+        values.append(('choosing', None, self.choosing))
+        self.journal.record('clear', values, ['reset'])
+        for field, index, value in values:
+            self.broadcast.set(field, index, value)
+        self.broadcast.set('selected', None, None)
+        self.broadcast.set('responding', None, None)
+
+    def serialize(self):
+        return {
+            'board': [self.board[x*self.rows:(x+1)*self.rows] for x in range(self.columns)],
+            'scores': self.scores,
+            'names': self.names,
+            'choosing': self.choosing,
+            'undo': [dump_entry(e) for e in self.undo_history],
+            'redo': [dump_entry(e) for e in self.redo_history],
+        }
+
+    def spectator_state(self):
+        """Everything spectators are shown, see cluequiz.broadcast."""
+        return {
+            'board': [self.board[x*self.rows:(x+1)*self.rows] for x in range(self.columns)],
+            'scores': self.scores,
+            'names': self.names,
+            'choosing': self.choosing,
+            'selected': None,
+            'responding': None,
+            'screen': 'choosing',
+            'categories': [],
+            'clue': None,
+            'question': None,
+        }
+
+    def save_state(self, action):
+        """Commit the changes since the last action to the history and the autosave."""
+        entry = HistoryEntry(action, tuple(self.changes))
+        self.changes = []
+        self.undo_history.append(entry)
+        self.redo_history = []
+        self.journal.record(action, [(c.field, c.index, c.new) for c in entry.changes], ['push', dump_entry(entry)])
 
     def rollback(self, age=1):
-        """Restore to the state of an history entry."""
-        if len(self.history) >= age:
+        """Undo the last age actions, as far as the history goes."""
+        for i in range(age):
+            if len(self.undo_history) == 0:
+                return
+            entry = self.undo_history.pop()
             if config.debug:
-                logger.warning('***************')
-                logger.warning('\tHistory before %s\n', self.history)
-
-            index = age * -1
-            self.history = self.history[0:index] or [self.history[0]]
-            restore = deepcopy(self.history[index])
-
+                logger.warning('Undoing %s', entry)
+            for c in reversed(entry.changes):
+                self.set_field(c.field, c.index, c.old)
+            self.redo_history.append(entry)
+            self.journal.record('undo', [(c.field, c.index, c.old) for c in reversed(entry.changes)], ['undo'])
+
+    def redo(self, age=1):
+        """Repeat the last age undone actions, unless there was another action since."""
+        for i in range(age):
+            if len(self.redo_history) == 0:
+                return
+            entry = self.redo_history.pop()
             if config.debug:
-                logger.warning('\tRolling back to %s\n', restore)
-                logger.warning('\tHistory after %s', self.history)
-
-            self.state, self.scores, self.choosing, self.responded = restore
+                logger.warning('Redoing %s', entry)
+            for c in entry.changes:
+                self.set_field(c.field, c.index, c.new)
+            self.undo_history.append(entry)
+            self.journal.record('redo', [(c.field, c.index, c.new) for c in entry.changes], ['redo'])
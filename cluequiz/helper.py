@@ -17,6 +17,14 @@
 from collections import namedtuple
 from logging import getLogger
 
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 
 logger = getLogger(__name__)
-GameStateHistory = namedtuple('GameStateHistory', ['state', 'scores', 'choosing', 'responded'])
+# A reversible change of the game state, index is [x, y] for the board and None for choosing
+Change = namedtuple('Change', ['field', 'index', 'old', 'new'])
+# The changes made by one action, in order
+HistoryEntry = namedtuple('HistoryEntry', ['action', 'changes'])
@@ -14,32 +14,186 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from .config import config
+from .config import MAX_PLAYERS, config
+from collections import namedtuple
+from logging import getLogger
 from paho.mqtt.client import Client
-from pygame.key import get_pressed
-from pygame.locals import K_1, K_2, K_3, K_4
+from pygame.locals import NUMEVENTS, USEREVENT
+from queue import Empty, SimpleQueue
+from random import choice
+from struct import Struct
+from threading import Thread
+from time import monotonic, sleep
+import pygame
 import serial
 
 TOPIC = 'cluequiz/pressed_button'
+BUTTONS = [str(i+1).encode() for i in range(config.players)]
 
-def open_serial(port, baud):
-    try:
-        return serial.Serial(port, baud, timeout=0)
-    except serial.SerialException:
-        return None
+# Posted when the serial connection is established or lost, with a connected attribute
+SERIALSTATE = USEREVENT + (44 % (NUMEVENTS-USEREVENT))
+
+logger = getLogger(__name__)
+
+# A ring-in by player (counting from 0) which arrived at time (time.monotonic) from source
+# and was taken from the queue at dequeued
+Press = namedtuple('Press', ['player', 'time', 'source', 'dequeued'], defaults=[None])
+
+FRAME_SYNC = 0xAA
+FRAME_PRESS = Struct('<BI')
+# Every button is pressed at most once per frame, so a larger count is a false sync byte
+MAX_PRESSES = MAX_PLAYERS
+
+def checksum(data):
+    c = 0
+    for b in data:
+        c = c ^ b
+    return c
+
+class FrameDecoder:
+    """Decodes the framed serial protocol.
+
+    A frame is the sync byte 0xAA, the number of presses n, n times the button
+    (counting from 1) followed by the press time in microseconds of the buzzer
+    box as little-endian uint32, and the XOR of all bytes after the sync byte.
+    n is between 1 and MAX_PRESSES.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Return (button, device time) of all presses completed by data."""
+        self.buffer.extend(data)
+        presses = []
+        while True:
+            start = self.buffer.find(FRAME_SYNC)
+            if start < 0:
+                self.buffer.clear()
+                return presses
+            del self.buffer[:start]
+            if len(self.buffer) < 2:
+                return presses
+            if self.buffer[1] < 1 or self.buffer[1] > MAX_PRESSES:
+                # Not waiting for the rest of an impossible frame keeps the frames after it
+                del self.buffer[:1]
+                continue
+            end = 2 + self.buffer[1] * FRAME_PRESS.size
+            if len(self.buffer) < end + 1:
+                return presses
+            if checksum(self.buffer[1:end]) != self.buffer[end]:
+                logger.warning('Dropping serial frame with bad checksum')
+                del self.buffer[:1]
+                continue
+            presses.extend(FRAME_PRESS.iter_unpack(bytes(self.buffer[2:end])))
+            del self.buffer[:end+1]
+
+class DeviceClock:
+    """Maps microsecond timestamps of the buzzer box onto time.monotonic.
+
+    The offset is the smallest difference between arrival and device time seen
+    so far, which is the frame with the least transmission delay. It may grow
+    by 100 ppm to follow a slower device clock. If the device clock restarts,
+    the offset is found again from the following frames.
+    """
+    WRAP = 1 << 32
+    DRIFT = 1e-4
+    # Frames are never delayed by more than this many seconds, a larger delay means the device clock restarted
+    MAX_DELAY = 1
+
+    def __init__(self):
+        self.offset = None
+        self.last = None
+        self.epoch = 0
+        self.arrival = None
+
+    def reset(self, reason):
+        logger.warning('Serial device clock %s, synchronizing again', reason)
+        self.offset = None
+        self.epoch = 0
+
+    def to_host(self, device, arrival):
+        if self.last != None and device < self.last:
+            if device < self.last - self.WRAP // 2:
+                self.epoch = self.epoch + self.WRAP
+            else:
+                self.reset('jumped back')
+        self.last = device
+        t = (self.epoch + device) / 1e6
+
+        if self.offset != None and arrival - t > self.offset + self.MAX_DELAY + (arrival - self.arrival) * self.DRIFT:
+            self.reset('fell behind')
+            t = device / 1e6
+        if self.offset == None or arrival - t < self.offset + (arrival - self.arrival) * self.DRIFT:
+            self.offset = arrival - t
+        else:
+            self.offset = self.offset + (arrival - self.arrival) * self.DRIFT
+        self.arrival = arrival
+        return t + self.offset
+
+class SerialConnection:
+    """Keeps a serial port open, retrying with exponential backoff while it is missing."""
+    MIN_BACKOFF = 0.1
+    MAX_BACKOFF = 2
+
+    def __init__(self, port, baud):
+        self.port = port
+        self.baud = baud
+        self.connected = False
+
+    def set_connected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        if connected:
+            logger.info('Serial port %s connected', self.port)
+        else:
+            logger.warning('Serial port %s disconnected', self.port)
+        pygame.event.post(pygame.event.Event(SERIALSTATE, { 'connected': connected }))
+
+    def run(self, handle, connected=None):
+        """Pass the bytes read to handle with their arrival time, forever.
+
+        connected is called whenever the port has been (re)opened.
+        """
+        backoff = self.MIN_BACKOFF
+        while True:
+            try:
+                with serial.Serial(self.port, self.baud, timeout=0.1) as s:
+                    self.set_connected(True)
+                    if connected:
+                        connected()
+                    backoff = self.MIN_BACKOFF
+                    while True:
+                        # Wait for one byte, then take everything that is buffered
+                        b = s.read(max(1, s.in_waiting))
+                        if len(b) > 0:
+                            handle(b, monotonic())
+            except (serial.SerialException, OSError):
+                self.set_connected(False)
+            sleep(backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
 
 class Input:
+    """Collects ring-ins from all sources with the time they arrived."""
+
     def __init__(self):
-        self.port = config('serial.port', '/dev/ttyUSB0')
-        self.baud = config('serial.baud', 9600)
-        self.serial = None
+        self.serial = SerialConnection(config.serial.port, config.serial.baud)
+        self.framed = config.serial.protocol == 'framed'
+        self.tie_window = config.input.tie_window / 1000
 
-        self.queue = []
-        if config('mqtt_input', None):
-            certfile = config('mqtt_input.certfile')
-            keyfile = config('mqtt_input.keyfile')
-            host = config('mqtt_input.host')
-            port = config('mqtt_input.port', 8883)
+        self.queue = SimpleQueue()
+        self.pending = []
+
+        self.reset_serial()
+        if config.serial.port:
+            Thread(target=self.serial.run, args=(self.read_serial, self.reset_serial), name='serial', daemon=True).start()
+
+        if config.mqtt_input:
+            certfile = config.mqtt_input.certfile
+            keyfile = config.mqtt_input.keyfile
+            host = config.mqtt_input.host
+            port = config.mqtt_input.port
 
             def on_connect(client, userdata, flags, rc):
                 if rc != 0:
@@ -48,10 +202,10 @@ class Input:
                 client.subscribe(TOPIC)
 
             def on_message(client, userdata, message):
-                if message.topic != TOPIC or message.payload not in [b'1', b'2', b'3', b'4']:
+                if message.topic != TOPIC or message.payload not in BUTTONS:
                     return
 
-                self.queue.append(message.payload)
+                self.push(BUTTONS.index(message.payload), 'mqtt')
 
             self.client = Client()
             self.client.on_connect = on_connect
@@ -60,27 +214,67 @@ class Input:
             self.client.connect(host, port)
             self.client.loop_start()
 
-    def keep_alive(self):
-        if not self.serial:
-            self.serial = open_serial(self.port, self.baud)
+    def push(self, player, source, time=None):
+        self.queue.put(Press(player, monotonic() if time == None else time, source))
 
-    def read(self):
-        if len(self.queue) > 0:
-            return self.queue.pop(0)
+    def key_pressed(self, player):
+        """Feed a ring-in from the keyboard, which is read by the render loop.
 
-        if self.serial:
-            try:
-                return self.serial.read()
-            except serial.SerialException:
-                self.serial = None
-
-        pressed = get_pressed()
-        if pressed[K_1]:
-            return b'1'
-        elif pressed[K_2]:
-            return b'2'
-        elif pressed[K_3]:
-            return b'3'
-        elif pressed[K_4]:
-            return b'4'
-        return b''
+        Key events are only handled once per frame, so keyboard presses are
+        stamped up to a frame later than serial and MQTT presses.
+        """
+        self.push(player, 'keyboard')
+
+    def reset_serial(self):
+        # The buzzer box may have restarted, so its clock has to be synchronized again
+        self.decoder = FrameDecoder()
+        self.clock = DeviceClock()
+
+    def read_serial(self, data, arrival):
+        if self.framed:
+            for button, device_time in self.decoder.feed(data):
+                if button >= 1 and button <= len(BUTTONS):
+                    self.push(button - 1, 'serial', self.clock.to_host(device_time, arrival))
+        else:
+            for b in data:
+                b = bytes((b,))
+                if b in BUTTONS:
+                    self.push(BUTTONS.index(b), 'serial', arrival)
+
+    def serial_connected(self):
+        return self.serial.connected
+
+    def collect(self):
+        try:
+            while True:
+                self.pending.append(self.queue.get_nowait()._replace(dequeued=monotonic()))
+        except Empty:
+            pass
+
+    def ring_in(self, eligible):
+        """Return the earliest press of a player for whom eligible is true, if any.
+
+        Presses within the tie window of the earliest one are considered
+        simultaneous and one of them is picked at random. The decision is only
+        made once the tie window has passed.
+        """
+        self.collect()
+        presses = sorted((p for p in self.pending if eligible(p.player)), key=lambda p: p.time)
+        if len(presses) == 0:
+            return None
+
+        first = presses[0]
+        if monotonic() < first.time + self.tie_window:
+            return None
+
+        tied = [p for p in presses if p.time - first.time <= self.tie_window]
+        winner = choice(tied) if len(tied) > 1 else first
+        self.pending = [p for p in self.pending if p is not winner]
+        logger.info('Ring-in by player %d via %s (candidates: %s)', winner.player + 1, winner.source,
+                ', '.join('%d via %s at %+.1f ms' % (p.player + 1, p.source, (p.time - first.time) * 1000) for p in presses))
+        return winner
+
+    def clear(self):
+        """Drop all presses received so far."""
+        self.collect()
+        self.pending = []
@@ -0,0 +1,73 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+from time import monotonic
+
+STAGES = ('dequeue', 'state', 'flip')
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a sorted list."""
+    return samples[max(0, -(-len(samples) * p // 100) - 1)]
+
+
+class LatencyTracer:
+    """Measures the time from a ring-in arriving to it being shown on screen.
+
+    For each input source the latest samples of every stage are kept, as
+    milliseconds since the press arrived.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.samples = {}
+        self.current = None
+
+    def responded(self, press):
+        """Start tracing a press which has just changed the game state."""
+        self.current = (press, monotonic())
+
+    def flipped(self):
+        """Finish the current trace once the frame showing it is on screen."""
+        if self.current == None:
+            return
+        press, state = self.current
+        self.current = None
+
+        samples = self.samples.get(press.source)
+        if samples == None:
+            samples = self.samples[press.source] = { stage: deque(maxlen=self.size) for stage in STAGES }
+        samples['dequeue'].append((press.dequeued - press.time) * 1000)
+        samples['state'].append((state - press.time) * 1000)
+        samples['flip'].append((monotonic() - press.time) * 1000)
+
+    def report(self):
+        lines = []
+        for source, samples in sorted(self.samples.items()):
+            for stage in STAGES:
+                s = sorted(samples[stage])
+                lines.append('%-8s %-7s n=%-4d %s' % (source, stage, len(s),
+                    ' '.join('p%d=%.2fms' % (p, percentile(s, p)) for p in PERCENTILES)))
+        return '\n'.join(lines)
+
+    def dump(self):
+        print('Ring-in latency since arrival:')
+        print(self.report() or 'no ring-ins yet')
+
+
+tracer = LatencyTracer()
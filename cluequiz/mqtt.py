@@ -15,15 +15,168 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from cluequiz.config import config
-from paho.mqtt.publish import single
-from json import dumps
+from paho.mqtt.client import MQTT_ERR_SUCCESS, Client
+from json import dumps, loads
+from logging import getLogger
+from os import fsync, replace
+from os.path import getsize
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from time import monotonic, time
 
-def publish_event(name, player, value):
-    host = config('mqtt.host', None)
-    if host:
-        port = config('mqtt.port', 1883)
-        topic = config('mqtt.topic', 'cluequiz')
+logger = getLogger(__name__)
+
+class Spool:
+    """Append-only file of events which could not be published.
+
+    Writes are fsynced in batches. The file is kept below max_bytes by dropping
+    the oldest events, and events older than max_age seconds are not replayed.
+    """
+    SYNC_INTERVAL = 1
+
+    def __init__(self, path, max_bytes, max_age):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.file = open(self.path, 'a')
+        self.size = getsize(self.path)
+        self.unsynced = False
+        self.synced = monotonic()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, payload):
+        line = payload + '\n'
+        if self.size + len(line) > self.max_bytes:
+            self.truncate(self.max_bytes * 3 // 4 - len(line))
+        self.file.write(line)
+        self.size = self.size + len(line)
+        self.unsynced = True
+
+    def sync(self, force=False):
+        if self.unsynced and (force or monotonic() - self.synced >= self.SYNC_INTERVAL):
+            self.file.flush()
+            fsync(self.file.fileno())
+            self.unsynced = False
+            self.synced = monotonic()
+
+    def read(self):
+        """Return all events which have not expired, oldest first."""
+        self.sync(force=True)
+        events = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    if time() - loads(line)['time'] <= self.max_age:
+                        events.append(line.rstrip('\n'))
+                except (ValueError, KeyError, TypeError):
+                    # Most likely a line cut short by a power loss
+                    pass
+        return events
+
+    def rewrite(self, events):
+        """Atomically replace the spooled events."""
+        self.file.close()
+        with open(self.path + '.tmp', 'w') as f:
+            for payload in events:
+                f.write(payload + '\n')
+            f.flush()
+            fsync(f.fileno())
+        replace(self.path + '.tmp', self.path)
+        self.file = open(self.path, 'a')
+        self.size = getsize(self.path)
+
+    def truncate(self, max_bytes):
+        events = self.read()
+        while len(events) > 0 and sum(len(e) + 1 for e in events) > max_bytes:
+            events.pop(0)
+        logger.warning('MQTT spool is full, dropping old events')
+        self.rewrite(events)
+
+class Publisher:
+    """Publishes events over one long-lived connection from a background thread."""
+
+    def __init__(self, host, port, topic, qos, size, spool=None):
+        self.topic = topic
+        self.qos = qos
+        self.spool = spool
+        self.queue = Queue(maxsize=size)
+        self.connected = Event()
+
+        def on_connect(client, userdata, flags, rc):
+            if rc == 0:
+                self.connected.set()
+
+        def on_disconnect(client, userdata, rc):
+            self.connected.clear()
+
+        self.client = Client()
+        self.client.on_connect = on_connect
+        self.client.on_disconnect = on_disconnect
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.connect_async(host, port)
+        self.client.loop_start()
+
+        Thread(target=self.run, name='mqtt-publish', daemon=True).start()
+
+    def publish(self, payload):
+        """Queue payload for publishing without ever blocking."""
         try:
-            single(topic, dumps({ 'name': name, 'player': player, 'value': value }), hostname=host, port=port)
-        except:
-            pass
+            self.queue.put_nowait(payload)
+        except Full:
+            logger.warning('MQTT queue is full, dropping %s', payload)
+
+    def send(self, payload):
+        if not self.connected.is_set():
+            return False
+        if self.client.publish(self.topic, payload, qos=self.qos).rc != MQTT_ERR_SUCCESS:
+            # Lost the connection in the meantime, wait for the reconnect
+            self.connected.clear()
+            return False
+        return True
+
+    def run(self):
+        if self.spool == None:
+            while True:
+                payload = self.queue.get()
+                while not self.send(payload):
+                    self.connected.wait()
+
+        while True:
+            try:
+                payload = self.queue.get(timeout=Spool.SYNC_INTERVAL)
+            except Empty:
+                payload = None
+            if len(self.spool) > 0 and self.connected.is_set():
+                self.replay()
+            if payload != None and (len(self.spool) > 0 or not self.send(payload)):
+                self.spool.append(payload)
+            self.spool.sync()
+
+    def replay(self):
+        """Publish spooled events in order, keeping those which could not be sent."""
+        events = self.spool.read()
+        for i, payload in enumerate(events):
+            if not self.send(payload):
+                self.spool.rewrite(events[i:])
+                return
+        self.spool.rewrite([])
+        if len(events) > 0:
+            logger.info('Replayed %d spooled MQTT events', len(events))
+
+publisher = None
+
+def publish_event(name, player, value):
+    global publisher
+    mqtt = config.mqtt
+    if mqtt.host:
+        if publisher == None:
+            spool = None
+            if mqtt.spool:
+                try:
+                    spool = Spool(mqtt.spool, mqtt.spool_size * 1024, mqtt.spool_expiry)
+                except OSError as e:
+                    logger.error('Cannot open MQTT spool %s, publishing without it: %s', mqtt.spool, e)
+            publisher = Publisher(mqtt.host, mqtt.port, mqtt.topic, mqtt.qos, mqtt.queue_size, spool)
+        publisher.publish(dumps({ 'name': name, 'player': player, 'value': value, 'time': time() }))
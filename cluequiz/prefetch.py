@@ -0,0 +1,44 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+class Prefetcher:
+    """Builds values ahead of time on an executor."""
+
+    def __init__(self, load, executor):
+        self.load = load
+        self.executor = executor
+        self.pending = {}
+
+    def prefetch(self, key):
+        """Start loading key unless it is already in flight."""
+        if key not in self.pending:
+            self.pending[key] = self.executor.submit(self.load, key)
+
+    def discard(self, key):
+        """Forget a prefetched value, e.g. because its source has changed."""
+        future = self.pending.pop(key, None)
+        if future != None:
+            future.cancel()
+
+    def get(self, key):
+        """Return the value for key, waiting for a prefetch if one was started.
+
+        Exceptions raised while loading in the background are re-raised here.
+        """
+        future = self.pending.pop(key, None)
+        if future is None:
+            future = self.executor.submit(self.load, key)
+        return future.result()
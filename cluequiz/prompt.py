@@ -28,18 +28,25 @@ class TextPrompt:
         self.bg = ( 31,  31,  31)
         self.fg = (255, 255, 255)
         self.fog = None
+        self.backdrop = None
 
         self.font = font
         self.width = width
         self.label = label
         self.rndrd_label = self.font.render(self.label, True, self.fg, self.bg)
         self.value = value
+        self.widths = []
+        for c in value:
+            self.widths.append(self.value_width() + self.font.size(c)[0])
         self.max_width = max_width
         self.placeholder = placeholder
         self.userdata = userdata
 
         self.render_value()
 
+    def value_width(self):
+        return self.widths[-1] if len(self.widths) > 0 else 0
+
     def render_value(self):
         self.rndrd_value = self.font.render(self.value if len(self.value) > 0 else self.placeholder, True, self.fg, CLUE_COLOR)
 
@@ -47,22 +54,42 @@ class TextPrompt:
         self.bg = bg
         self.fg = fg
         self.fog = None
+        self.backdrop = None
         self.rndrd_label = self.font.render(self.label, True, self.fg, self.bg)
 
+    def resize(self, width):
+        """Lay the prompt out again for a different display size."""
+        self.width = width
+        self.max_width = width
+        self.x, self.y, self.w, self.h, self.left, self.top = (None, None, None, None, None, None)
+        self.fog = None
+        self.backdrop = None
+
     def set_userdata(self, userdata):
         self.userdata = userdata
 
     def show(self):
         self.visible = True
+        self.backdrop = None
 
     def reset(self):
         self.visible = False
         self.value = ''
+        self.widths = []
+        self.backdrop = None
         self.render_value()
 
     def is_visible(self):
         return self.visible
 
+    def has_backdrop(self):
+        return self.backdrop != None
+
+    def get_rect(self):
+        if self.w == None or self.h == None:
+            return None
+        return pygame.Rect(self.x, self.y, self.w, self.h)
+
     def handle(self, event):
         if not self.visible:
             return
@@ -74,13 +101,26 @@ class TextPrompt:
             elif event.key == K_DELETE:
                 self.reset()
             elif event.key == K_BACKSPACE:
-                self.value = self.value[:-1] if len(self.value) > 0 else ''
+                self.value = self.value[:-1]
+                self.widths = self.widths[:len(self.value)]
                 self.render_value()
-            elif not self.max_width or self.font.size(self.value + event.unicode)[0] <= self.max_width:
-                self.value = self.value + event.unicode
-                self.render_value()
-
-    def update(self, display):
+            elif len(event.unicode) > 0:
+                # Only measure the new characters, not the whole value
+                widths = []
+                for c in event.unicode:
+                    widths.append((widths[-1] if len(widths) > 0 else self.value_width()) + self.font.size(c)[0])
+                if not self.max_width or widths[-1] <= self.max_width:
+                    self.value = self.value + event.unicode
+                    self.widths.extend(widths)
+                    self.render_value()
+
+    def update(self, display, full=True):
+        """Draw the prompt.
+
+        The first update after showing the prompt fogs whatever is on the display
+        and keeps it as backdrop; later updates only redraw the text field unless
+        full is set.
+        """
         if not self.visible:
             return
 
@@ -100,10 +140,14 @@ class TextPrompt:
             self.fog = pygame.Surface(display.get_size(), flags=SRCALPHA)
             self.fog.fill(FOG_COLOR)
 
-        display.blit(self.fog, (0, 0))
-        display.fill(self.bg, rect=pygame.Rect(self.x, self.y, self.w, self.h))
+        if self.backdrop == None:
+            display.blit(self.fog, (0, 0))
+            display.fill(self.bg, rect=pygame.Rect(self.x, self.y, self.w, self.h))
+            display.blit(self.rndrd_label, self.rndrd_label.get_rect(centerx=dw//2).move(0, self.top))
+            self.backdrop = display.copy()
+        elif full:
+            display.blit(self.backdrop, (0, 0))
 
-        display.blit(self.rndrd_label, self.rndrd_label.get_rect(centerx=dw//2).move(0, self.top))
         display.fill(CLUE_COLOR, rect=pygame.Rect(self.left+CELL_PADDING, self.top+2*linesize, self.width+2*CELL_PADDING, linesize+2*CELL_PADDING))
 
         display.set_clip(pygame.Rect(self.left+2*CELL_PADDING, self.top+2*linesize+CELL_PADDING, self.width, linesize))
@@ -0,0 +1,207 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from collections import namedtuple
+from functools import partial
+from io import BytesIO
+from math import gcd
+from os.path import dirname, isfile, join
+from pygments import highlight
+from pygments.formatters import ImageFormatter
+from pygments.lexers import get_lexer_by_name
+from yaml import load
+
+from cluequiz.assets import Asset
+from cluequiz.bundle import Bundle, is_bundle
+from cluequiz.cache import SurfaceCache, default_directory
+from cluequiz.config import config
+from cluequiz.helper import YamlLoader
+from cluequiz.sound import load_sound
+from cluequiz.style import *
+from cluequiz.surface import display_format, load_image
+from cluequiz.text import TextLayout
+
+ClueSet = namedtuple('ClueSet', ['names', 'sources', 'categories', 'clues', 'questions', 'rendered'])
+
+# What clues are rendered for: the width of the board and of a column, the
+# height of a cell and of the area above the score bar
+ClueSize = namedtuple('ClueSize', ['screen_w', 'clue_w', 'cell_h', 'clue_h'])
+
+
+def clue_size(screen_size):
+    columns = config.board.columns
+    rows = config.board.rows
+    # Both the columns and the players take up a whole number of units
+    units = columns * config.players // gcd(columns, config.players)
+    cell_w = screen_size[0] // units
+    half_cell_h = screen_size[1] // ((rows + 2) * 2)
+    # One row for the categories and one for the score bar
+    return ClueSize(cell_w * units, cell_w * (units // columns), half_cell_h * 2, half_cell_h * 2 * (rows + 1))
+
+
+class ClueRenderer:
+    """Turns clue sets into lazily loaded assets for the current display size.
+
+    Clue sets are either YAML files or bundles compiled from them (see
+    cluequiz.compiler). Assets are only loaded on the asset thread, which
+    has fonts of its own.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.layout = TextLayout(FONT_PATH)
+        self.biglayout = TextLayout(BIGFONT_PATH)
+        cache = default_directory() if config.cache is True else config.cache
+        self.cache = SurfaceCache(cache) if cache else None
+        self.stream_threshold = config.sound.stream_threshold * 1024
+        self.bundles = {}
+
+    def open_bundle(self, yml):
+        """Map the bundle yml again if it has been replaced, None if yml is no bundle."""
+        if not is_bundle(yml):
+            return None
+        bundle = self.bundles.get(yml)
+        if bundle is None or bundle.replaced():
+            bundle = self.bundles[yml] = Bundle(yml)
+        return bundle
+
+    def load_image(self, name, bg):
+        try:
+            image = load_image(name, (self.size.screen_w, self.size.clue_h), bg)
+        except (OSError, ValueError) as e:
+            raise OSError('Could not load image %s: %s' % (name, e)) from e
+
+        if config.debug:
+            print(name, image.get_size())
+
+        return image
+
+    def render_code(self, code, lang):
+        formatter = ImageFormatter(font_size=FONT_SIZE, line_numbers=False, style=CODE_STYLE)
+        image = pygame.image.load(BytesIO(highlight(code, get_lexer_by_name(lang), formatter)), 'code.png')
+        return image.convert()
+
+    def cached(self, key, render, *args, sources=(), bundle=None):
+        """Take a surface from the bundle or render it through the on-disk cache, if enabled."""
+        if bundle != None:
+            surface = bundle.surface(key)
+            if surface != None:
+                return display_format(surface)
+        if self.cache is None:
+            return render(*args)
+        return display_format(self.cache.get(key, partial(render, *args), sources))
+
+    def render_text(self, text, bundle=None):
+        """Render a clue or question into the area above the score bar."""
+        size = self.size
+        key = ('text', text, BIGFONT_PATH, BIGFONT_SIZE, size.screen_w, size.clue_h)
+        return self.cached(key, self.biglayout.render, text, TEXT_COLOR, size.screen_w, size.clue_h, BIGFONT_SIZE, bundle=bundle)
+
+    def render_category(self, text, bundle=None):
+        size = self.size
+        key = ('text', text, FONT_PATH, FONT_SIZE, size.clue_w, size.cell_h)
+        return self.cached(key, self.layout.render, text, TEXT_COLOR, size.clue_w, size.cell_h, FONT_SIZE, bundle=bundle)
+
+    def render_image(self, yml, name, bg, bundle=None):
+        key = ('image', name, bg, self.size.screen_w, self.size.clue_h)
+        if bundle != None:
+            # Bundles only contain the original file if compiled for another size
+            surface = bundle.surface(key)
+            return display_format(surface) if surface != None else self.load_image(bundle.open(name), bg)
+        path = join(dirname(yml), name)
+        return self.cached(key, self.load_image, path, bg, sources=[path])
+
+    def parse_clue_set(self, yml):
+        """Return the category names and the clue definitions of a clue set."""
+        bundle = self.open_bundle(yml)
+        if bundle != None:
+            clue_set = bundle.clue_set
+        else:
+            with open(yml, 'r') as f:
+                clue_set = list(load(f, YamlLoader).items())
+
+        names = []
+        sources = []
+        for category, cs in clue_set:
+            if len(cs) != config.board.rows:
+                raise ValueError('A valid category has exactly %d clues' % config.board.rows)
+            for o in cs:
+                if 'sound' not in o and 'image' not in o and 'clue' not in o:
+                    raise ValueError('Clue has neither text nor image nor sound')
+                self.check_file(yml, bundle, o)
+            names.append(category)
+            sources.append(cs)
+
+        if len(names) != config.board.columns:
+            raise ValueError('A valid clue set has exactly %d categories' % config.board.columns)
+        return names, sources
+
+    def check_file(self, yml, bundle, o):
+        """Fail on a missing sound or image now rather than once its clue is selected."""
+        name = o.get('sound', o.get('image'))
+        if name is None:
+            return
+        if bundle != None:
+            if name not in bundle.files:
+                raise ValueError('%s does not contain %s' % (yml, name))
+        elif not isfile(self.clue_file(yml, o)):
+            raise FileNotFoundError('Could not find %s' % self.clue_file(yml, o))
+
+    def clue_file(self, yml, o):
+        """The sound or image file a clue refers to, if any (bundles contain them)."""
+        if is_bundle(yml):
+            return None
+        if 'sound' in o:
+            return join(dirname(yml), o['sound'])
+        elif 'image' in o:
+            return join(dirname(yml), o['image'])
+        return None
+
+    def clue_asset(self, yml, o):
+        bundle = self.open_bundle(yml)
+        if 'sound' in o:
+            if bundle != None:
+                return Asset('sound', partial(bundle.sound, o['sound'], self.stream_threshold))
+            path = self.clue_file(yml, o)
+            if config.debug:
+                print(path)
+            return Asset('sound', partial(load_sound, path, self.stream_threshold))
+        elif 'image' in o:
+            bg = None if 'bg' not in o else o['bg']
+            return Asset('image', partial(self.render_image, yml, o['image'], bg, bundle))
+        elif 'lang' in o:
+            key = ('code', o['clue'], o['lang'])
+            return Asset('code', partial(self.cached, key, self.render_code, o['clue'], o['lang'], bundle=bundle))
+        return Asset('text', partial(self.render_text, o['clue'], bundle))
+
+    def question_asset(self, yml, o):
+        return Asset('text', partial(self.render_text, str(o['question']), self.open_bundle(yml)))
+
+    def category_asset(self, yml, name):
+        return Asset('category', partial(self.render_category, name, self.open_bundle(yml)))
+
+    def build_clue_set(self, yml):
+        """Parse a clue set, render its categories and prepare its lazy assets.
+
+        This runs on the asset thread and must not touch state used for drawing.
+        """
+        names, sources = self.parse_clue_set(yml)
+        categories = [self.category_asset(yml, name) for name in names]
+        clues = [[self.clue_asset(yml, o) for o in cs] for cs in sources]
+        questions = [[self.question_asset(yml, o) for o in cs] for cs in sources]
+        rendered = { asset: asset.load() for asset in categories }
+        return ClueSet(names, sources, categories, clues, questions, rendered)
@@ -0,0 +1,196 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from copy import deepcopy
+from json import dumps, loads
+from logging import getLogger
+from os import fsync, replace
+from os.path import exists
+from queue import SimpleQueue
+from threading import Thread
+from yaml import load
+
+from cluequiz.helper import Change, HistoryEntry, YamlLoader
+
+logger = getLogger(__name__)
+
+# Parts of the game state which are saved, responded is only kept in the history
+FIELDS = ['board', 'scores', 'names', 'choosing']
+
+
+def journal_path(path):
+    return path + '.journal'
+
+
+def dump_entry(entry):
+    return [entry.action, [list(change) for change in entry.changes]]
+
+
+def load_entry(entry):
+    return HistoryEntry(entry[0], tuple(Change(*change) for change in entry[1]))
+
+
+def set_field(save, field, index, value):
+    if field == 'board':
+        save['board'][index[0]][index[1]] = value
+    elif field == 'choosing':
+        save['choosing'] = value
+    elif field in FIELDS:
+        save[field][index] = value
+
+
+def apply(save, record, depth):
+    """Apply a journal entry to a save."""
+    for field, index, value in record['set']:
+        set_field(save, field, index, value)
+
+    op = record.get('history')
+    if op == None:
+        return
+    elif op[0] == 'push':
+        save['undo'].append(op[1])
+        del save['undo'][:max(0, len(save['undo']) - depth)]
+        save['redo'] = []
+    elif op[0] == 'undo':
+        save['redo'].append(save['undo'].pop())
+    elif op[0] == 'redo':
+        save['undo'].append(save['redo'].pop())
+    elif op[0] == 'reset':
+        save['undo'] = []
+        save['redo'] = []
+
+
+def load_save(path, depth):
+    """Read a snapshot and replay the journal next to it, if there is one."""
+    with open(path, 'r') as f:
+        text = f.read()
+    try:
+        save = loads(text)
+    except ValueError:
+        # Saves of older versions are YAML
+        save = load(text, YamlLoader)
+    seq = save.get('seq', 0)
+    save.setdefault('undo', [])
+    save.setdefault('redo', [])
+
+    if exists(journal_path(path)):
+        with open(journal_path(path)) as f:
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    # Cut short by a crash, everything after it is lost anyway
+                    logger.warning('Ignoring incomplete journal entry in %s', journal_path(path))
+                    break
+                # Entries up to seq are already part of the snapshot
+                if record['seq'] > seq:
+                    apply(save, record, depth)
+                    seq = record['seq']
+    save['seq'] = seq
+    return save
+
+
+def write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(data)
+        f.flush()
+        fsync(f.fileno())
+    replace(tmp, path)
+
+
+class Journal:
+    """Saves the game in the background as a snapshot and a journal of changes.
+
+    The snapshot also holds the undo and redo history, which the journal
+    entries update with push, undo, redo and reset operations, each keeping
+    at most depth entries. Every change is appended to the journal and fsynced. After compact changes
+    a new snapshot is written to a temporary file and renamed over the old one,
+    and the journal starts over. The first change always writes a snapshot, so
+    an older save at the same path is only replaced once the game has started.
+    """
+
+    def __init__(self, path, compact, depth, save, seq=0):
+        self.path = path
+        self.compact = compact
+        self.depth = depth
+        self.seq = seq
+        if exists(path):
+            # Keep numbering above the entries of an older save at the same path
+            try:
+                self.seq = max(seq, load_save(path, depth)['seq'])
+            except Exception as e:
+                logger.warning('Cannot read previous save %s: %s', path, e)
+        try:
+            # Opened here so a bad path fails at startup rather than in the writer thread
+            self.journal = open(journal_path(path), 'a')
+        except OSError as e:
+            raise SystemExit('Cannot write the autosave to %s: %s' % (path, e))
+        self.queue = SimpleQueue()
+        self.thread = Thread(target=self.run, args=(deepcopy(save),), name='autosave', daemon=True)
+        self.thread.start()
+
+    def record(self, action, values, history=None):
+        """Queue an action for writing, called from the game.
+
+        values are the (field, index, value) changes made by the action and
+        history is the operation on the undo history, if any.
+        """
+        self.seq = self.seq + 1
+        self.queue.put({
+            'seq': self.seq,
+            'action': action,
+            'set': [[field, index, value] for field, index, value in values if field in FIELDS],
+            'history': history,
+        })
+
+    def close(self):
+        """Wait until everything queued so far has been written."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def snapshot(self, save, seq):
+        # JSON is much faster to write than YAML with a long history, and still valid YAML
+        write_atomic(self.path, dumps(dict(save, seq=seq)))
+        # A crash before the truncation is harmless, the entries have seq <= the snapshot's
+        self.journal.seek(0)
+        self.journal.truncate()
+
+    def run(self, save):
+        pending = 0
+        snapshotted = False
+        while True:
+            record = self.queue.get()
+            if record == None:
+                try:
+                    self.journal.close()
+                except OSError as e:
+                    logger.error('Autosave to %s failed: %s', self.path, e)
+                return
+            apply(save, record, self.depth)
+            try:
+                if not snapshotted or pending >= self.compact:
+                    self.snapshot(save, record['seq'])
+                    snapshotted = True
+                    pending = 0
+                else:
+                    self.journal.write(dumps(record) + '\n')
+                    if self.queue.empty():
+                        self.journal.flush()
+                        fsync(self.journal.fileno())
+                    pending = pending + 1
+            except OSError as e:
+                logger.error('Autosave to %s failed: %s', self.path, e)
@@ -21,29 +21,33 @@ from pygame.locals import (
     K_SPACE,
     KEYDOWN,
     K_1,
-    K_2,
-    K_3,
-    K_4,
     K_f,
     K_j,
     K_n,
+    K_r,
     K_t,
     K_u,
     MOUSEBUTTONDOWN,
-    SRCALPHA,
+    NUMEVENTS,
+    USEREVENT,
+    VIDEOEXPOSE,
+    VIDEORESIZE,
+    WINDOWSIZECHANGED,
 )
-from PIL import Image
-from yaml import Loader, load
-from os.path import dirname, join
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import ImageFormatter
-from io import BytesIO
-
-from cluequiz.input import Input
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from cluequiz.assets import ASSETSREADY, AssetStore
+from cluequiz.bundle import is_bundle
+from cluequiz.input import SERIALSTATE, Input
+from cluequiz.latency import tracer
+from cluequiz.prefetch import Prefetcher
 from cluequiz.style import *
+from cluequiz.render import ClueRenderer, clue_size
+from cluequiz.watch import FILECHANGED, FileWatcher
 from cluequiz.config import config
 from cluequiz.prompt import TEXTINPUTREADY, TextPrompt
+from cluequiz.sound import SOUNDS, get_loaded, load_music
 
 CHOOSING = 0
 DISPLAY_CLUE = 1
@@ -51,171 +55,296 @@ RESPONDING = 2
 DISPLAY_QUESTION = 3
 SCOREBOARD = 4
 
+# How the states are called when broadcast to spectators
+STATE_NAMES = ['choosing', 'clue', 'responding', 'question', 'scoreboard']
+
+logger = getLogger(__name__)
+
+# Posted by the asset thread with the changes found when reloading a clue set
+CLUESETRELOADED = USEREVENT + (46 % (NUMEVENTS-USEREVENT))
+
 class Screen:
     def __init__(self, instance):
         self.input = Input()
+        self.serial_status = None
+        self.dirty = []
+        self.board = None
+        self.state = None
 
-        screen_size = pygame.display.get_surface().get_size()
-        if config.debug:
-            screen_size = (800, 600)
-
-        self.screen_w = screen_size[0] - (screen_size[0] % 12)
-        cell_w = screen_size[0] // 12
-        self.clue_w = cell_w * 2
-        self.score_w = cell_w * 3
-        half_cell_h = screen_size[1] // 14
-        self.cell_h = half_cell_h * 2
-        self.score_h = half_cell_h * 7
-        self.padding = ((screen_size[0] % 12) // 2, (screen_size[1] % 14) // 2)
+        self.size = pygame.display.get_surface().get_size()
+        self.compute_layout(self.size)
 
         self.font = pygame.font.Font(FONT_PATH, FONT_SIZE)
         self.bigfont = pygame.font.Font(BIGFONT_PATH, BIGFONT_SIZE)
-
-        self.music = config('music', None)
+        self.render_serial_status(self.input.serial_connected())
+        # Assets are rendered on a single background thread with fonts of their own
+        self.renderer = ClueRenderer(self.clue_size)
+        loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='assets')
+        self.prefetcher = Prefetcher(self.renderer.build_clue_set, loader)
+        self.loader = loader
+        # Shown instead of clues whose files cannot be loaded
+        placeholder = self.bigfont.render('Could not load this clue', True, TEXT_COLOR)
+        self.assets = AssetStore(loader, config.assets.budget * 1024 * 1024, placeholder)
+        self.clue_set = None
+        self.watcher = FileWatcher()
+        self.broadcast = instance.broadcast
+        self.question = None
+
+        self.music = config.music
         if self.music:
             if isinstance(self.music, str):
                 self.music = [self.music]
             self.load_next_music()
 
         self.values = []
-        for i in range(1, 6):
+        for i in range(1, config.board.rows + 1):
             self.values.append(self.font.render(str(i*100), True, TEXT_COLOR, CLUE_COLOR))
-        self.scores = [ None, None, None, None ]
+        self.scores = [None] * config.players
         self.render_score(None, instance)
-        self.names = [ None, None, None, None ]
+        self.names = [None] * config.players
         self.render_name(None, instance)
 
-        self.load_clue_set(instance.next_clue_set())
+        self.load_next_clue_set(instance)
 
         self.prompt = TextPrompt(self.font, self.score_w, 'Player name', max_width=self.score_w, placeholder='Hier könnte dein Name stehen')
 
         self.sound_triggered = False
         self.state = CHOOSING
+        self.invalidate()
+
+    def compute_layout(self, screen_size):
+        """Divide the display among the board, the score bar and the scoreboard.
+
+        All rectangles are computed once here, drawing only looks them up.
+        """
+        if config.debug:
+            screen_size = (800, 600)
+
+        columns = config.board.columns
+        rows = config.board.rows
+        players = config.players
+        self.clue_size = clue_size(screen_size)
+        self.screen_w, self.clue_w, self.cell_h, self.clue_h = self.clue_size
+        # The players take up a whole number of the units the columns are made of
+        self.score_w = self.screen_w // players
+        half_cell_h = self.cell_h // 2
+        self.padding = ((screen_size[0] - self.screen_w) // 2, (screen_size[1] - half_cell_h * (rows + 2) * 2) // 2)
+
+        self.clue_rect = self.offset_rect(0, 0, self.screen_w, self.clue_h)
+        self.category_rects = [self.offset_rect(self.clue_w*x, 0, self.clue_w, self.cell_h) for x in range(columns)]
+        self.cell_rects = [[self.offset_rect(self.clue_w*x, self.cell_h*(y+1), self.clue_w, self.cell_h)
+                for y in range(rows)] for x in range(columns)]
+        self.cell_fills = [[self.pad_rect(self.clue_w*x, self.cell_h*(y+1), self.clue_w, self.cell_h, CELL_PADDING)
+                for y in range(rows)] for x in range(columns)]
+        self.score_rects = [self.offset_rect(self.score_w*i, self.clue_h, self.score_w, self.cell_h) for i in range(players)]
+        self.score_fills = [self.pad_rect(self.score_w*i, self.clue_h, self.score_w, self.cell_h, CELL_PADDING) for i in range(players)]
+
+        # The scoreboard has up to two rows of players
+        board_rows = 1 if players < 3 else 2
+        board_columns = -(-players // board_rows)
+        w = self.screen_w // board_columns
+        h = half_cell_h * (rows + 2) * 2 // board_rows
+        self.scoreboard_rects = [self.offset_rect(w * (i % board_columns), h * (i // board_columns), w, h) for i in range(players)]
+
+    def resize(self, instance):
+        """Adapt the layout to a changed display size.
+
+        Assets whose size depends on the layout are re-rendered in the
+        background; until they are ready the old ones are shown.
+        """
+        size = pygame.display.get_surface().get_size()
+        if size == self.size:
+            return
+        self.size = size
+        self.compute_layout(size)
+        # The asset thread may be rendering, so the size changes between its jobs
+        self.loader.submit(setattr, self.renderer, 'size', self.clue_size)
+        self.prompt.resize(self.score_w)
+        self.assets.reload(('category', 'text', 'image'))
+        upcoming = instance.peek_clue_set()
+        if upcoming != self.clue_set:
+            # Its categories were rendered for the old size
+            self.prefetcher.discard(upcoming)
+            self.prefetcher.prefetch(upcoming)
+        self.board = None
+        self.invalidate()
 
     def change_state(self, state):
         if self.state == CHOOSING and state == DISPLAY_CLUE:
             self.sound_triggered = False
+        elif state == CHOOSING:
+            self.broadcast.set('clue', None, None)
+            self.broadcast.set('question', None, None)
+            self.broadcast.set('responding', None, None)
+        elif state == DISPLAY_QUESTION and not config.viewer:
+            # In viewer mode the question is shown right away and must not reach spectators
+            self.broadcast.set('question', None, self.question)
         self.state = state
+        self.broadcast.set('screen', None, STATE_NAMES[state])
+        self.invalidate()
+
+    def invalidate(self, rect=None):
+        """Mark a region (or the whole display) to be redrawn on the next update."""
+        full = pygame.display.get_surface().get_rect()
+        if rect is None or full in self.dirty:
+            self.dirty = [full]
+        else:
+            self.dirty.append(rect)
+
+    def is_idle(self):
+        """Whether the screen only changes in response to events."""
+        if self.state == DISPLAY_CLUE:
+            return False
+        return not (self.music_loaded() and pygame.mixer.music.get_busy())
 
     def load_next_music(self):
         music = self.music[0]
-        pygame.mixer.music.load(music)
+        load_music(music)
         self.music = self.music[1:] + [music]
 
-    def read_input(self):
-        b = self.input.read()
-        if len(b) > 0:
-            i = b[0] - 49
-            if i >= 0 and i < 4:
-                return i
-        return None
+    def music_loaded(self):
+        """Whether the music stream holds background music rather than a streamed clue."""
+        return self.music and get_loaded() in self.music
 
     def empty_input(self):
-        b = self.input.read()
-        while len(b) > 0:
-            b = self.input.read()
+        self.input.clear()
 
-    def load_image(self, name, bg):
+    def load_clue_set(self, yml):
+        if yml != self.clue_set:
+            clue_set = self.prefetcher.get(yml)
+            self.category_names, self.sources = clue_set.names, clue_set.sources
+            self.categories, self.clues, self.questions = clue_set.categories, clue_set.clues, clue_set.questions
+            self.clue_set = yml
+            self.assets.clear()
+            for asset, value in clue_set.rendered.items():
+                self.assets.put(asset, value)
+            self.broadcast.set('categories', None, list(self.category_names))
+        self.invalidate_board()
+
+    def watch_clue_sets(self, upcoming):
+        paths = [self.clue_set, upcoming]
+        for cs in self.sources:
+            for o in cs:
+                path = self.renderer.clue_file(self.clue_set, o)
+                if path:
+                    paths.append(path)
+        self.watcher.watch(paths)
+
+    def reload_clue_set(self, yml, names, sources, path):
+        """Re-render the parts of the current clue set affected by a changed file.
+
+        This runs on the asset thread. Changed entries are materialized here and
+        posted with CLUESETRELOADED, so the render loop never waits for them.
+        Entries which fail to load keep their previous version. Entries posted
+        without a value are loaded when they are needed.
+        """
         try:
-            im = Image.open(name)
-        except IOError as msg:
-            print('Could not load image ', name)
-            raise SystemExit(msg)
-
-        w, h = im.size
-        if w > self.screen_w:
-            w = self.screen_w
-        if h > self.cell_h*6:
-            h = self.cell_h * 6
-        im.thumbnail((w, h))
+            new_names, new_sources = self.renderer.parse_clue_set(yml) if path == yml else (names, sources)
+        except Exception as e:
+            logger.error('Keeping the previous version of %s: %s', yml, e)
+            return
 
-        if config.debug:
-            print(name, im.mode)
-
-        image = pygame.image.fromstring(im.tobytes('raw', im.mode), im.size, im.mode)
-        image.convert()
-
-        if bg:
-            image_bg = pygame.Surface(im.size)
-            image_bg.fill(bg)
-            image_bg.blit(image, (0, 0))
-            return image_bg
-
-        return image
-
-    def render_code(self, code, lang):
-        formatter = ImageFormatter(font_size=FONT_SIZE, line_numbers=False, style=CODE_STYLE)
-        image = pygame.image.load(BytesIO(highlight(code, get_lexer_by_name(lang), formatter)), 'code.png')
-        image.convert()
-        return image
-
-    def render_wrapped(self, text, font, color, line_w):
-        lines = []
-        space_left = 0
-        space_width = font.size(' ')[0]
-        for w in text.split():
-            width = font.size(w)[0]
-            if (space_width + width) > space_left:
-                lines.append(w)
-                space_left = line_w - width
+        # The files embedded in a bundle may have changed along with it
+        embedded = path == yml and is_bundle(yml)
+        changes = []
+        # Entries of a changed bundle which look the same, loaded again once needed
+        # as the previous versions may have been read while it was being written
+        lazy = []
+        for x, name in enumerate(new_names):
+            if name != names[x] or embedded:
+                changes.append(('category', x, None, self.renderer.category_asset(yml, name)))
+            for y, o in enumerate(new_sources[x]):
+                if o != sources[x][y] or self.renderer.clue_file(yml, o) == path or (embedded and ('image' in o or 'sound' in o)):
+                    changes.append(('clue', x, y, self.renderer.clue_asset(yml, o)))
+                elif embedded:
+                    lazy.append(('clue', x, y, self.renderer.clue_asset(yml, o), None))
+                if o.get('question') != sources[x][y].get('question'):
+                    changes.append(('question', x, y, self.renderer.question_asset(yml, o)))
+                elif embedded:
+                    lazy.append(('question', x, y, self.renderer.question_asset(yml, o), None))
+
+        loaded = lazy
+        for grid, x, y, asset in changes:
+            try:
+                loaded.append((grid, x, y, asset, asset.load()))
+            except Exception as e:
+                # Only entries whose new version loaded are swapped
+                logger.error('Keeping the previous version of a %s of %s: %s', grid, yml, e)
+                if grid == 'category':
+                    new_names[x] = names[x]
+        pygame.event.post(pygame.event.Event(CLUESETRELOADED, {
+            'clue_set': yml, 'names': new_names, 'sources': new_sources, 'changes': loaded }))
+
+    def apply_reload(self, event, instance):
+        if event.clue_set != self.clue_set:
+            return
+        for grid, x, y, asset, value in event.changes:
+            if grid == 'category':
+                self.categories[x] = asset
+            elif grid == 'clue':
+                self.clues[x][y] = asset
             else:
-                lines[-1] = lines[-1] + ' ' + w
-                space_left = space_left - (space_width + width)
-
-        line_h = font.get_linesize()
-        target = pygame.Surface((line_w, len(lines)*line_h), flags=SRCALPHA)
-        for i, l in enumerate(lines):
-            line = font.render(l, True, color)
-            target.blit(line, line.get_rect(centerx=line_w*0.5, centery=line_h*(i+0.5)))
-        return target
-
-    def load_clue_set(self, yml):
-        with open(yml, 'r') as f:
-            clue_set = load(f, Loader)
-
-        self.categories = []
-        self.clues = [ [], [], [], [], [], [] ]
-        self.questions = [ [], [], [], [], [], [] ]
-        for category, clues in clue_set.items():
-            if len(clues) != 5:
-                raise ValueError('A valid category has exactly five clues')
-            for o in clues:
-                i = len(self.categories)
-                if 'sound' in o:
-                    path = join(dirname(yml), o['sound'])
-                    if config.debug:
-                        print(path)
-                    self.clues[i].append(pygame.mixer.Sound(path))
-                elif 'image' in o:
-                    bg = None if 'bg' not in o else o['bg']
-                    self.clues[i].append(self.load_image(join(dirname(yml), o['image']), bg))
-                elif 'clue' in o:
-                    if 'lang' in o:
-                        self.clues[i].append(self.render_code(o['clue'], o['lang']))
-                    else:
-                        self.clues[i].append(self.render_wrapped(o['clue'], self.bigfont, TEXT_COLOR, self.screen_w))
-                else:
-                    raise ValueError('Clue has neither text nor image nor sound')
-                self.questions[i].append(self.render_wrapped(str(o['question']), self.bigfont, TEXT_COLOR, self.screen_w))
-            self.categories.append(self.render_wrapped(category, self.font, TEXT_COLOR, self.clue_w))
-
-        if len(self.categories) != 6:
-            raise ValueError('A valid clue set has exactly six categories')
+                self.questions[x][y] = asset
+            if value != None:
+                self.assets.put(asset, value)
+        self.category_names, self.sources = event.names, event.sources
+        self.broadcast.set('categories', None, list(self.category_names))
+        self.watch_clue_sets(instance.peek_clue_set())
+        self.invalidate_board()
+        self.invalidate()
+        logger.info('Reloaded %d entries of %s', len(event.changes), self.clue_set)
+
+    def select_clue(self, x, y):
+        """Show the selected clue to spectators, the question only once it is revealed."""
+        o = self.sources[x][y]
+        clue = { key: o[key] for key in ('clue', 'image', 'sound', 'lang') if key in o }
+        clue['category'] = self.category_names[x]
+        clue['value'] = (y+1) * 100
+        self.broadcast.set('clue', None, clue)
+        self.question = o.get('question')
+
+    def prefetch_around(self, instance, x, y):
+        """Start loading the selected clue, its question and the clues next to it."""
+        assets = [self.clues[x][y], self.questions[x][y]]
+        for i, j in ((x, y+1), (x-1, y), (x+1, y), (x, y-1)):
+            if i >= 0 and i < instance.columns and j >= 0 and j < instance.rows and instance.get_state_at(i, j) == None:
+                assets.append(self.clues[i][j])
+        self.assets.prefetch(assets)
+
+    def load_next_clue_set(self, instance):
+        """Swap in the next clue set and start preparing the one after it."""
+        self.load_clue_set(instance.next_clue_set())
+        upcoming = instance.peek_clue_set()
+        if upcoming != self.clue_set:
+            self.prefetcher.prefetch(upcoming)
+        self.watch_clue_sets(upcoming)
 
     def render_score(self, player, instance):
         """Render a specific or all player's scores."""
         if player is None:
-            for player in range(4):
+            for player in range(instance.players):
                 self.render_score(player, instance)
         else:
             self.scores[player] = self.font.render(str(instance.get_score(player)), True, TEXT_COLOR)
+            self.invalidate(self.score_rects[player])
+            self.board = None
 
     def render_name(self, player, instance):
         if player == None:
-            for player in range(4):
+            for player in range(instance.players):
                 self.render_name(player, instance)
         else:
             self.names[player] = self.font.render(instance.get_name(player), True, TEXT_COLOR)
+            self.invalidate(self.score_rects[player])
+            self.board = None
+
+    def render_serial_status(self, connected):
+        """Warn the host about a missing buzzer box if serial input is configured."""
+        if connected or not config.serial.configured:
+            self.serial_status = None
+        else:
+            self.serial_status = self.font.render('Serial disconnected', True, TEXT_COLOR, CLUE_COLOR)
+        self.invalidate()
 
     def offset_rect(self, x, y, w, h):
         return pygame.Rect(self.padding[0] + x, self.padding[1] + y, w, h)
@@ -224,16 +353,46 @@ class Screen:
         return pygame.Rect(self.padding[0]+p+x, self.padding[1]+p+y, w-2*p, h-2*p)
 
     def handle(self, event, instance):
+        if event.type == VIDEOEXPOSE:
+            self.invalidate()
+        elif event.type == ASSETSREADY:
+            if event.asset.kind == 'category':
+                # The board was composited from the categories of the old size
+                self.board = None
+            self.invalidate()
+        elif event.type == VIDEORESIZE or event.type == WINDOWSIZECHANGED:
+            self.resize(instance)
+        elif event.type == SERIALSTATE:
+            self.render_serial_status(event.connected)
+        elif event.type == FILECHANGED:
+            if event.path == instance.peek_clue_set() and event.path != self.clue_set:
+                self.prefetcher.discard(event.path)
+                self.prefetcher.prefetch(event.path)
+            else:
+                names = list(self.category_names)
+                sources = [list(cs) for cs in self.sources]
+                self.loader.submit(self.reload_clue_set, self.clue_set, names, sources, event.path)
+        elif event.type == CLUESETRELOADED:
+            self.apply_reload(event, instance)
+
         if self.prompt.is_visible():
             self.prompt.handle(event)
+            self.invalidate(self.prompt.get_rect() if self.prompt.is_visible() else None)
             return
 
         if event.type == KEYDOWN:
             if event.key == K_f:
                 pygame.display.toggle_fullscreen()
-            elif event.key == K_u:
-                instance.rollback(1)
+                self.resize(instance)
+                self.invalidate()
+            elif event.key == K_u or event.key == K_r:
+                if event.key == K_u:
+                    instance.rollback(1)
+                else:
+                    instance.redo(1)
                 self.render_score(None, instance)
+                self.invalidate_board()
+                self.invalidate()
         elif event.type == TEXTINPUTREADY:
             if event.userdata != None:
                 instance.set_name(event.userdata, event.value)
@@ -243,49 +402,47 @@ class Screen:
             if event.type == MOUSEBUTTONDOWN:
                 x = (event.pos[0] - self.padding[0]) // self.clue_w
                 y = (event.pos[1] - self.padding[1]) // self.cell_h - 1
-                if x >= 0 and x < 6 and y >= 0 and y < 5 and instance.get_state_at(x, y) == None:
+                if x >= 0 and x < instance.columns and y >= 0 and y < instance.rows and instance.get_state_at(x, y) == None:
                     instance.set_selected(x, y)
+                    self.select_clue(x, y)
+                    self.prefetch_around(instance, x, y)
                     self.change_state(DISPLAY_QUESTION if config.viewer else DISPLAY_CLUE)
                     self.empty_input()
             elif event.type == KEYDOWN:
                 if event.key == K_DELETE:
                     instance.clear()
                     self.render_score(None, instance)
-                    self.load_clue_set(instance.next_clue_set())
-                elif event.key == K_1:
-                    self.prompt.set_style(PLAYERS[0])
-                    self.prompt.set_userdata(0)
-                    self.prompt.show()
-                elif event.key == K_2:
-                    self.prompt.set_style(PLAYERS[1])
-                    self.prompt.set_userdata(1)
-                    self.prompt.show()
-                elif event.key == K_3:
-                    self.prompt.set_style(PLAYERS[2])
-                    self.prompt.set_userdata(2)
-                    self.prompt.show()
-                elif event.key == K_4:
-                    self.prompt.set_style(PLAYERS[3])
-                    self.prompt.set_userdata(3)
+                    self.load_next_clue_set(instance)
+                    self.invalidate()
+                elif event.key >= K_1 and event.key < K_1 + instance.players:
+                    player = event.key - K_1
+                    self.prompt.set_style(PLAYERS[player])
+                    self.prompt.set_userdata(player)
                     self.prompt.show()
+                    self.invalidate()
         elif self.state == DISPLAY_CLUE:
             if event.type == KEYDOWN:
-                if event.key == K_BACKSPACE:
+                if event.key >= K_1 and event.key < K_1 + instance.players:
+                    self.input.key_pressed(event.key - K_1)
+                elif event.key == K_BACKSPACE:
                     instance.clear_responded()
                     self.change_state(CHOOSING)
                 elif event.key == K_DELETE:
                     instance.ignore_clue()
+                    self.invalidate_board()
                     instance.clear_responded()
                     self.change_state(DISPLAY_QUESTION)
                 elif event.key == K_SPACE:
                     x, y = instance.get_selected()
-                    s = self.clues[x][y]
-                    if isinstance(s, pygame.mixer.Sound):
+                    s = self.assets.get(self.clues[x][y])
+                    if isinstance(s, SOUNDS):
                         s.play()
                 elif event.key == K_t and self.music:
-                    if pygame.mixer.music.get_busy():
+                    if self.music_loaded() and pygame.mixer.music.get_busy():
                         self.load_next_music()
                     else:
+                        if not self.music_loaded():
+                            self.load_next_music()
                         pygame.mixer.music.play(-1)
         elif self.state == RESPONDING:
             if event.type == KEYDOWN:
@@ -299,6 +456,7 @@ class Screen:
                     self.render_score(instance.get_responding(), instance)
                     if instance.all_responded():
                         instance.ignore_clue()
+                        self.invalidate_board()
                         instance.clear_responded()
                         self.change_state(DISPLAY_QUESTION)
                     else:
@@ -307,7 +465,7 @@ class Screen:
         elif self.state == DISPLAY_QUESTION:
             if event.type == KEYDOWN:
                 if instance.finished():
-                    for i in range(4):
+                    for i in range(instance.players):
                         self.scores[i] = self.bigfont.render(str(instance.get_score(i)), True, TEXT_COLOR, PLAYERS[i])
                         self.names[i] = self.bigfont.render(instance.get_name(i), True, TEXT_COLOR, PLAYERS[i])
                     self.change_state(SCOREBOARD)
@@ -318,67 +476,101 @@ class Screen:
                 instance.clear()
                 self.render_score(None, instance)
                 self.render_name(None, instance)
-                self.load_clue_set(instance.next_clue_set())
+                self.load_next_clue_set(instance)
                 self.change_state(CHOOSING)
 
+    def invalidate_board(self):
+        """Drop the composited board so it is rebuilt on the next update."""
+        self.board = None
+        if self.state == CHOOSING:
+            self.invalidate()
+
+    def render_board(self, instance):
+        """Composite categories, cells and score bar of the choosing screen."""
+        display = pygame.display.get_surface()
+        board = pygame.Surface(display.get_size()).convert(display)
+        board.fill(BACKGROUND)
+
+        for i, c in enumerate(self.categories):
+            c = self.assets.get(c)
+            board.blit(c, c.get_rect(center=self.category_rects[i].center))
+        for j, v in enumerate(self.values):
+            for i in range(instance.columns):
+                s = instance.get_state_at(i, j)
+                if s == None:
+                    board.fill(CLUE_COLOR, rect=self.cell_fills[i][j])
+                    board.blit(v, v.get_rect(center=self.cell_rects[i][j].center))
+                elif s >= 0:
+                    board.fill(PLAYERS[s], rect=self.cell_fills[i][j])
+        self.draw_score_bar(board, instance.get_choosing())
+        return board
+
+    def draw_score_bar(self, target, choosing):
+        name_y = self.font.get_linesize() + CELL_PADDING
+        for i, rect in enumerate(self.score_rects):
+            target.fill(PLAYERS[i], rect=rect)
+            if i == choosing:
+                target.fill(BACKGROUND, rect=self.score_fills[i])
+            target.blit(self.scores[i], self.scores[i].get_rect(center=rect.center))
+            target.blit(self.names[i], self.names[i].get_rect(centerx=rect.centerx, top=rect.bottom-name_y))
+
     def update(self, instance):
-        self.input.keep_alive()
         if self.state == DISPLAY_CLUE:
-            i = self.read_input()
-            if i != None and instance.set_responding(i):
+            press = self.input.ring_in(instance.may_respond)
+            if press != None and instance.set_responding(press.player):
+                tracer.responded(press)
                 self.change_state(RESPONDING)
-        elif self.music and pygame.mixer.music.get_busy():
+        elif self.music_loaded() and pygame.mixer.music.get_busy():
             self.load_next_music()
 
-        display = pygame.display.get_surface()
-        display.fill(BACKGROUND if self.state != RESPONDING else PLAYERS[instance.get_responding()])
+        if self.state in (DISPLAY_CLUE, RESPONDING) and not self.sound_triggered:
+            x, y = instance.get_selected()
+            s = self.assets.get(self.clues[x][y])
+            if isinstance(s, SOUNDS):
+                s.play()
+            self.sound_triggered = True
+        self.broadcast.flush()
 
+        if len(self.dirty) == 0:
+            return []
+
+        display = pygame.display.get_surface()
         px, py = self.padding
 
+        if self.prompt.has_backdrop():
+            # The prompt covers everything else with a snapshot
+            self.prompt.update(display, self.dirty == [display.get_rect()])
+            return self.flush_dirty()
+
         if self.state == CHOOSING:
-            for i, c in enumerate(self.categories):
-                display.blit(c, c.get_rect(centerx=px+self.clue_w*(i+0.5), centery=py+self.cell_h*0.5))
-            for j in range(5):
-                v = self.values[j]
-                for i in range(6):
-                    s = instance.get_state_at(i, j)
-                    if s == None:
-                        display.fill(CLUE_COLOR, rect=self.pad_rect(self.clue_w*i, self.cell_h*(j+1), self.clue_w, self.cell_h, CELL_PADDING))
-                        display.blit(v, v.get_rect(centerx=px+self.clue_w*(i+0.5), centery=py+self.cell_h*(j+1.5)))
-                    elif s >= 0:
-                        display.fill(PLAYERS[s], rect=self.pad_rect(self.clue_w*i, self.cell_h*(j+1), self.clue_w, self.cell_h, CELL_PADDING))
+            if self.board is None:
+                self.board = self.render_board(instance)
+            display.blit(self.board, (0, 0))
         elif self.state == SCOREBOARD:
-            display.fill(PLAYERS[0], rect=self.offset_rect(0,              0,            self.score_w*2, self.score_h))
-            display.fill(PLAYERS[1], rect=self.offset_rect(self.score_w*2, 0,            self.score_w*2, self.score_h))
-            display.fill(PLAYERS[2], rect=self.offset_rect(0,              self.score_h, self.score_w*2, self.score_h))
-            display.fill(PLAYERS[3], rect=self.offset_rect(self.score_w*2, self.score_h, self.score_w*2, self.score_h))
-            display.blit(self.scores[0], self.scores[0].get_rect(centerx=px+self.score_w,   centery=py+self.score_h*0.5))
-            display.blit(self.scores[1], self.scores[1].get_rect(centerx=px+self.score_w*3, centery=py+self.score_h*0.5))
-            display.blit(self.scores[2], self.scores[2].get_rect(centerx=px+self.score_w,   centery=py+self.score_h*1.5))
-            display.blit(self.scores[3], self.scores[3].get_rect(centerx=px+self.score_w*3, centery=py+self.score_h*1.5))
-            display.blit(self.names[0], self.names[0].get_rect(centerx=px+self.score_w).move(0, py+self.score_h-(self.bigfont.get_linesize()+CELL_PADDING)))
-            display.blit(self.names[1], self.names[1].get_rect(centerx=px+self.score_w*3).move(0, py+self.score_h-(self.bigfont.get_linesize()+CELL_PADDING)))
-            display.blit(self.names[2], self.names[2].get_rect(centerx=px+self.score_w).move(0, py+self.score_h*2-(self.bigfont.get_linesize()+CELL_PADDING)))
-            display.blit(self.names[3], self.names[3].get_rect(centerx=px+self.score_w*3).move(0, py+self.score_h*2-(self.bigfont.get_linesize()+CELL_PADDING)))
+            display.fill(BACKGROUND)
+            name_y = self.bigfont.get_linesize() + CELL_PADDING
+            for i, rect in enumerate(self.scoreboard_rects):
+                display.fill(PLAYERS[i], rect=rect)
+                display.blit(self.scores[i], self.scores[i].get_rect(center=rect.center))
+                display.blit(self.names[i], self.names[i].get_rect(centerx=rect.centerx, top=rect.bottom-name_y))
         else:
+            display.fill(BACKGROUND if self.state != RESPONDING else PLAYERS[instance.get_responding()])
             x, y = instance.get_selected()
             if self.state == DISPLAY_QUESTION:
-                s = self.questions[x][y]
+                s = self.assets.get(self.questions[x][y])
             else:
-                s = self.clues[x][y]
-            if isinstance(s, pygame.mixer.Sound):
-                if not self.sound_triggered:
-                    s.play()
-                    self.sound_triggered = True
-            else:
-                display.blit(s, s.get_rect(centerx=px+self.clue_w*3, centery=py+self.cell_h*3))
+                s = self.assets.get(self.clues[x][y])
+            if not isinstance(s, SOUNDS):
+                display.blit(s, s.get_rect(center=self.clue_rect.center))
+            self.draw_score_bar(display, None)
 
-        if self.state != SCOREBOARD:
-            for i in range(4):
-                display.fill(PLAYERS[i], rect=self.offset_rect(self.score_w*i, self.cell_h*6, self.score_w, self.cell_h))
-                if self.state == CHOOSING and i == instance.get_choosing():
-                    display.fill(BACKGROUND, rect=self.pad_rect(self.score_w*i, self.cell_h*6, self.score_w, self.cell_h, CELL_PADDING))
-                display.blit(self.scores[i], self.scores[i].get_rect(centerx=px+self.score_w*(i+0.5), centery=py+self.cell_h*6.5))
-                display.blit(self.names[i], self.names[i].get_rect(centerx=px+self.score_w*(i+0.5)).move(0, py+self.cell_h*7-(self.font.get_linesize()+CELL_PADDING)))
+        if self.serial_status:
+            display.blit(self.serial_status, (px, py))
 
         self.prompt.update(display)
+        return self.flush_dirty()
+
+    def flush_dirty(self):
+        dirty = self.dirty
+        self.dirty = []
+        return dirty
@@ -0,0 +1,252 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Play synthetic games headless and as fast as possible.
+
+    python -m cluequiz.simulate [--games N] [--seed S] [--script FILE]
+
+The config file (CONFIG_FILE or config.yml) is used with the overrides from
+SIMULATION, so no serial port, broker or save of a real show is touched. A
+script has one event per line:
+
+    click X Y       click the clue in column X and row Y (counting from 0)
+    key NAME        press a key, NAME as in pygame.key.key_code, e.g. space
+    type TEXT       type TEXT (into the name prompt)
+    ring P          ring-in of player P (counting from 1)
+    frames N        draw N frames without input, e.g. to let assets load
+    expect STATE    fail unless the screen is in STATE, e.g. RESPONDING
+
+Without a script, random games are played until --games have finished.
+"""
+
+import argparse
+from os import environ
+from os.path import join
+from random import Random
+from resource import RUSAGE_SELF, getrusage
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from yaml import dump, load
+
+from cluequiz.helper import YamlLoader
+
+# Applied on top of the config file
+SIMULATION = {
+    'serial': { 'port': None },
+    'mqtt': None,
+    'mqtt_input': None,
+    'broadcast': { 'host': None, 'socket': None, 'mqtt-topic': None },
+    'music': None,
+    'input': { 'tie-window': 0 },
+    'render': { 'idle': False },
+}
+
+STATES = ['CHOOSING', 'DISPLAY_CLUE', 'RESPONDING', 'DISPLAY_QUESTION', 'SCOREBOARD']
+
+
+def write_config(values, directory):
+    """Write values with the simulation overrides to directory, return the path."""
+    values = dict(values)
+    for key, value in SIMULATION.items():
+        if isinstance(value, dict):
+            values[key] = dict(values.get(key) or {}, **value)
+        elif value == None:
+            values.pop(key, None)
+    values['autosave'] = dict(values.get('autosave') or {}, path=join(directory, 'autosave.yml'))
+    path = join(directory, 'config.yml')
+    with open(path, 'w') as f:
+        f.write(dump(values))
+    return path
+
+
+class Simulation:
+    """Feeds events to a Game and a Screen and measures every frame.
+
+    Only import this after CONFIG_FILE has been set, see run.
+    """
+
+    def __init__(self, size, seed=None):
+        import pygame
+        from cluequiz.game import Game
+        from cluequiz.screen import Screen
+
+        self.pygame = pygame
+        pygame.display.init()
+        pygame.font.init()
+        pygame.mixer.init()
+        pygame.display.set_mode(size)
+        self.random = Random(seed)
+        self.game = Game(None)
+        self.screen = Screen(self.game)
+        self.frames = { state: [] for state in STATES }
+        self.games = 0
+        self.events = 0
+
+    def step(self, event=None):
+        """Handle pending events and event, if any, then draw a frame."""
+        pygame = self.pygame
+        events = pygame.event.get()
+        if event != None:
+            events.append(event)
+            self.events = self.events + 1
+        for e in events:
+            was = self.screen.state
+            self.screen.handle(e, self.game)
+            if was == STATES.index('SCOREBOARD') and self.screen.state != was:
+                self.games = self.games + 1
+
+        state = STATES[self.screen.state]
+        start = perf_counter()
+        dirty = self.screen.update(self.game)
+        self.frames[state].append(perf_counter() - start)
+        if dirty:
+            pygame.display.update(dirty)
+        self.check()
+
+    def check(self):
+        """Fail on states the game should never get into."""
+        game = self.game
+        for cell in game.board:
+            assert cell == None or cell >= -1 and cell < game.players, 'Invalid cell %r' % cell
+        assert game.remaining == game.board.count(None), 'Remaining clues miscounted'
+        assert game.choosing >= 0 and game.choosing < game.players, 'Invalid choosing player %r' % game.choosing
+        if self.screen.state == STATES.index('RESPONDING'):
+            assert game.get_responding() != None, 'Responding without a player'
+        if self.screen.state != STATES.index('CHOOSING'):
+            assert game.get_selected() != None, 'No clue selected'
+
+    def key(self, name, text=''):
+        pygame = self.pygame
+        return pygame.event.Event(pygame.KEYDOWN, key=pygame.key.key_code(name), unicode=text, mod=0)
+
+    def click(self, x, y):
+        pos = self.screen.cell_rects[x][y].center
+        return self.pygame.event.Event(self.pygame.MOUSEBUTTONDOWN, pos=pos, button=1)
+
+    def random_event(self):
+        """Pick an event a host or player could plausibly cause in this state."""
+        r = self.random.random()
+        state = STATES[self.screen.state]
+        if self.screen.prompt.is_visible():
+            return self.key('return') if r < 0.2 else self.key('a', self.random.choice('abcxyz '))
+        elif state == 'CHOOSING':
+            free = [(x, y) for x in range(self.game.columns) for y in range(self.game.rows) if self.game.get_state_at(x, y) == None]
+            if r < 0.02:
+                return self.key('u')
+            elif r < 0.04:
+                return self.key('r')
+            elif r < 0.05:
+                return self.key(str(self.random.randint(1, self.game.players)))
+            elif len(free) == 0:
+                return self.key('delete')
+            return self.click(*self.random.choice(free))
+        elif state == 'DISPLAY_CLUE':
+            if r < 0.05:
+                return self.key('backspace')
+            elif r < 0.15:
+                return self.key('delete')
+            elif r < 0.2:
+                return self.key('space')
+            return self.key(str(self.random.randint(1, self.game.players)))
+        elif state == 'RESPONDING':
+            return self.key('j' if r < 0.5 else 'n')
+        return self.key('space')
+
+    def play(self, games, verbose=False):
+        while self.games < games:
+            played = self.games
+            # Leave some frames without input, as there are between real events
+            self.step(self.random_event() if self.random.random() < 0.7 else None)
+            if verbose and self.games > played:
+                print('game %d: %d events, max RSS %d KiB, assets %d KiB' % (self.games, self.events,
+                        getrusage(RUSAGE_SELF).ru_maxrss, sum(self.screen.assets.usage().values()) // 1024))
+
+    def run_script(self, lines):
+        for n, line in enumerate(lines, 1):
+            words = line.split('#', 1)[0].split()
+            if len(words) == 0:
+                continue
+            command, args = words[0], words[1:]
+            if command == 'click':
+                self.step(self.click(int(args[0]), int(args[1])))
+            elif command == 'key':
+                self.step(self.key(args[0]))
+            elif command == 'type':
+                for c in line.split(None, 1)[1].rstrip('\n'):
+                    self.step(self.key('a', c))
+            elif command == 'ring':
+                self.screen.input.push(int(args[0]) - 1, 'simulation')
+                self.step()
+            elif command == 'frames':
+                for i in range(int(args[0])):
+                    self.step()
+            elif command == 'expect':
+                if STATES[self.screen.state] != args[0]:
+                    raise AssertionError('Line %d: expected %s, but the screen is in %s' % (n, args[0], STATES[self.screen.state]))
+            else:
+                raise ValueError('Line %d: unknown command %s' % (n, command))
+
+    def report(self):
+        lines = ['%d games, %d events, max RSS %d KiB' % (self.games, self.events, getrusage(RUSAGE_SELF).ru_maxrss)]
+        for state, samples in self.frames.items():
+            if len(samples) == 0:
+                continue
+            samples = sorted(samples)
+            lines.append('%-16s n=%-6d p50=%.2fms p95=%.2fms p99=%.2fms max=%.2fms' % (state, len(samples),
+                    *(samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000 for p in (50, 95, 99)), samples[-1] * 1000))
+        return '\n'.join(lines)
+
+
+def run(values, games=1, seed=None, script=None, size=(1280, 720), verbose=False):
+    """Simulate with the config values, return the Simulation afterwards.
+
+    This has to be called before anything but cluequiz.helper and
+    cluequiz.simulate has been imported, as the config is read on import.
+    """
+    environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    with TemporaryDirectory() as directory:
+        environ['CONFIG_FILE'] = write_config(values, directory)
+        simulation = Simulation(size, seed)
+        if script != None:
+            simulation.run_script(script)
+        else:
+            simulation.play(games, verbose)
+        simulation.game.journal.close()
+    return simulation
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play synthetic games without display, sound card or keyboard.')
+    parser.add_argument('--games', type=int, default=1, help='number of random games to play')
+    parser.add_argument('--seed', type=int, help='seed of the random games')
+    parser.add_argument('--script', type=argparse.FileType('r'), help='play the events in this file instead')
+    parser.add_argument('--size', default='1280x720', help='display size, e.g. 1920x1080')
+    parser.add_argument('--verbose', action='store_true', help='print memory usage after every game')
+    args = parser.parse_args()
+
+    with open(environ.get('CONFIG_FILE', 'config.yml')) as f:
+        values = load(f, YamlLoader) or {}
+    size = tuple(int(v) for v in args.size.split('x'))
+    script = args.script.readlines() if args.script else None
+    try:
+        print(run(values, args.games, args.seed, script, size, args.verbose).report())
+    except AssertionError as e:
+        raise SystemExit('Simulation failed: %s' % e)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from io import BytesIO
+from os.path import getsize
+
+# File currently loaded into the pygame.mixer.music stream
+loaded = None
+
+
+def load_music(path, data=None):
+    """Load a file, or its contents if given, into the music stream."""
+    global loaded
+    pygame.mixer.music.load(path if data is None else BytesIO(data))
+    loaded = path
+
+
+def get_loaded():
+    return loaded
+
+
+class StreamedSound:
+    """A sound clue that is decoded from disk while it plays.
+
+    Only one file can be streamed at a time, so it shares the music stream
+    with the background music. Sounds from a bundle are streamed from its
+    contents, path then only names them.
+    """
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data
+
+    def play(self):
+        if loaded != self.path:
+            load_music(self.path, self.data)
+        pygame.mixer.music.play()
+
+
+SOUNDS = (pygame.mixer.Sound, StreamedSound)
+
+
+def load_sound(path, threshold):
+    """Preload short clips, stream files larger than threshold bytes."""
+    if getsize(path) > threshold:
+        return StreamedSound(path)
+    return pygame.mixer.Sound(path)
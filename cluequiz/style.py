@@ -20,8 +20,12 @@ FONT_PATH = None # match_font('Comic Sans')
 FONT_SIZE = 36
 BIGFONT_PATH = None
 BIGFONT_SIZE = 96
+# Texts which do not fit their box are shrunk down to this size at most
+MIN_FONT_SIZE = 16
 
-PLAYERS = ((255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 191, 0))
+# One color per player, at most nine players are supported
+PLAYERS = ((255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 191, 0), (191, 0, 255),
+        (0, 191, 191), (255, 0, 127), (127, 127, 0), (255, 127, 63))
 
 BACKGROUND = (  0,   0,   0)
 TEXT_COLOR = (255, 255, 255)
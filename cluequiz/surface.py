@@ -0,0 +1,65 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from PIL import Image
+from pygame.locals import SRCALPHA
+
+
+def display_format(surface):
+    """Convert a surface to the pixel format of the display for fast blits."""
+    if surface.get_flags() & SRCALPHA:
+        return surface.convert_alpha()
+    return surface.convert()
+
+
+def normalize_mode(im):
+    """Convert any PIL image to RGB or RGBA, which pygame understands."""
+    if im.mode.startswith('I;16'):
+        # Scale 16 bit greyscale down to 8 bit instead of clipping it
+        im = im.convert('I').point(lambda v: v * (1 / 256)).convert('L')
+    elif im.mode in ('I', 'F'):
+        hi = im.getextrema()[1]
+        if hi > 255:
+            im = im.point(lambda v: v * (255 / hi))
+        im = im.convert('L')
+    if im.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in im.info:
+        return im.convert('RGBA')
+    if im.mode != 'RGB':
+        return im.convert('RGB')
+    return im
+
+
+def load_image(name, max_size, bg=None):
+    """Decode an image into a display format surface no larger than max_size.
+
+    Transparent images are composited onto bg if given and keep their alpha
+    channel otherwise.
+    """
+    im = Image.open(name)
+    im.draft('RGB', max_size)
+    im = normalize_mode(im)
+    im.thumbnail(max_size)
+
+    image = pygame.image.frombuffer(im.tobytes(), im.size, im.mode)
+    if bg:
+        image_bg = pygame.Surface(im.size).convert()
+        image_bg.fill(bg)
+        image_bg.blit(image, (0, 0))
+        return image_bg
+    if im.mode == 'RGBA':
+        return image.convert_alpha()
+    return image.convert()
@@ -0,0 +1,97 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from pygame.locals import SRCALPHA
+
+from cluequiz.style import MIN_FONT_SIZE
+
+
+class TextLayout:
+    """Wraps text into a box, shrinking the font until it fits.
+
+    Fonts and word widths are cached per size, so laying out many texts with
+    the same font only measures each word once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fonts = {}
+        self.widths = {}
+
+    def font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = pygame.font.Font(self.path, size)
+            self.widths[size] = { ' ': font.size(' ')[0] }
+        return font
+
+    def width(self, word, size):
+        widths = self.widths[size]
+        w = widths.get(word)
+        if w is None:
+            w = widths[word] = self.fonts[size].size(word)[0]
+        return w
+
+    def wrap(self, words, size, line_w, strict=True):
+        """Greedily break words into lines.
+
+        If strict, None is returned when a single word is wider than a line.
+        """
+        self.font(size)
+        space_width = self.widths[size][' ']
+        lines = []
+        space_left = 0
+        for w in words:
+            width = self.width(w, size)
+            if strict and width > line_w:
+                return None
+            if (space_width + width) > space_left:
+                lines.append(w)
+                space_left = line_w - width
+            else:
+                lines[-1] = lines[-1] + ' ' + w
+                space_left = space_left - (space_width + width)
+        return lines
+
+    def fits(self, words, size, box_w, box_h):
+        lines = self.wrap(words, size, box_w)
+        return lines is not None and len(lines) * self.font(size).get_linesize() <= box_h
+
+    def fit(self, text, box_w, box_h, max_size):
+        """Return the largest size up to max_size at which text fits the box, and its lines."""
+        words = text.split()
+        lo, hi = MIN_FONT_SIZE, max_size
+        if self.fits(words, hi, box_w, box_h):
+            lo = hi
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.fits(words, mid, box_w, box_h):
+                lo = mid
+            else:
+                hi = mid - 1
+        # Words too wide even at the smallest size overflow their line
+        return lo, self.wrap(words, lo, box_w, strict=False)
+
+    def render(self, text, color, box_w, box_h, max_size):
+        size, lines = self.fit(text, box_w, box_h, max_size)
+        font = self.font(size)
+        line_h = font.get_linesize()
+        target = pygame.Surface((box_w, len(lines)*line_h), flags=SRCALPHA)
+        for i, l in enumerate(lines):
+            line = font.render(l, True, color)
+            target.blit(line, line.get_rect(centerx=box_w*0.5, centery=line_h*(i+0.5)))
+        return target.convert_alpha()
@@ -0,0 +1,60 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pygame
+from os import stat
+from pygame.locals import NUMEVENTS, USEREVENT
+from threading import Lock, Thread
+from time import sleep
+
+# Posted with a path attribute when a watched file was modified
+FILECHANGED = USEREVENT + (45 % (NUMEVENTS-USEREVENT))
+
+
+def mtime(path):
+    try:
+        return stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class FileWatcher:
+    """Polls files for modifications in a background thread."""
+
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.lock = Lock()
+        self.mtimes = {}
+        Thread(target=self.run, name='watch', daemon=True).start()
+
+    def watch(self, paths):
+        """Replace the set of watched files."""
+        mtimes = { path: mtime(path) for path in paths }
+        with self.lock:
+            self.mtimes = mtimes
+
+    def run(self):
+        while True:
+            sleep(self.interval)
+            with self.lock:
+                paths = list(self.mtimes.items())
+            for path, last in paths:
+                current = mtime(path)
+                if current != last:
+                    with self.lock:
+                        if path in self.mtimes:
+                            self.mtimes[path] = current
+                    pygame.event.post(pygame.event.Event(FILECHANGED, { 'path': path }))
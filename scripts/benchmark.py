@@ -0,0 +1,332 @@
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from json import dump, load
+from os import environ, makedirs
+from os.path import join
+from PIL import Image
+from platform import platform, python_version
+from struct import pack
+from subprocess import run
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter
+import pygame
+import sys
+import wave
+import yaml
+
+from cluequiz.simulate import STATES, Simulation, write_config
+
+FORMAT = 1
+KINDS = ['text', 'code', 'image', 'sound']
+HISTORY_SIZES = [10, 100, 1000, 10000]
+
+CODE = '''def fib(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+'''
+
+# Starts the game in a new process and exits after the first frame
+STARTUP = '''
+import sys
+from os import environ
+environ['CONFIG_FILE'] = sys.argv[1]
+environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+from cluequiz.simulate import Simulation
+Simulation((int(sys.argv[2]), int(sys.argv[3]))).step()
+'''
+
+
+def summary(samples):
+    """Median, 95th percentile and count of samples in seconds, as milliseconds."""
+    samples = sorted(samples)
+    return {
+        'median': samples[len(samples) // 2] * 1000,
+        'p95': samples[min(len(samples) - 1, len(samples) * 95 // 100)] * 1000,
+        'n': len(samples),
+    }
+
+
+def timed(f, *args):
+    start = perf_counter()
+    f(*args)
+    return perf_counter() - start
+
+
+def write_clue_sets(directory, size):
+    """Write one clue set per kind of clue, all clues of a set being of that kind."""
+    image = join(directory, 'image.jpg')
+    Image.effect_noise(size, 64).convert('RGB').save(image, quality=90)
+    sound = join(directory, 'sound.wav')
+    with wave.open(sound, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(bytes(44100 * 4 * 3))
+
+    paths = {}
+    for kind in KINDS:
+        clue_set = {}
+        for i in range(6):
+            clues = []
+            for j in range(5):
+                if kind == 'text':
+                    clue = { 'clue': 'This clue number %d of category %d is long enough to be wrapped over several lines' % (j, i) }
+                elif kind == 'code':
+                    clue = { 'clue': CODE.replace('fib', 'fib%d%d' % (i, j)), 'lang': 'python' }
+                else:
+                    clue = { kind: image if kind == 'image' else sound }
+                clue['question'] = 'Question %d of category %d' % (j, i)
+                clues.append(clue)
+            clue_set['%s category %d' % (kind.capitalize(), i)] = clues
+        paths[kind] = join(directory, kind + '.yml')
+        with open(paths[kind], 'w') as f:
+            yaml.dump(clue_set, f)
+    return paths
+
+
+def bench_startup(values, directory, size, repeat):
+    """Wall time from starting the process to the first frame, with an empty and a filled cache."""
+    results = { 'startup.cold': [], 'startup.warm': [] }
+    for i in range(repeat):
+        run_directory = join(directory, 'startup%d' % i)
+        makedirs(run_directory)
+        config = write_config(dict(values, cache=join(run_directory, 'cache')), run_directory)
+        for name in ['startup.cold', 'startup.warm']:
+            start = perf_counter()
+            run([sys.executable, '-c', STARTUP, config, str(size[0]), str(size[1])], check=True)
+            results[name].append(perf_counter() - start)
+    return results
+
+
+def bench_assets(simulation, paths, size):
+    """Loading a clue set and materializing its clues, with an empty and a filled cache and from a bundle."""
+    from cluequiz.compiler import compile_clue_set
+
+    screen = simulation.screen
+    bundles = {}
+    results = {}
+    for temperature in ['cold', 'warm', 'bundle']:
+        if temperature == 'bundle':
+            # Compiling goes through the cache, so it would warm up the cold runs
+            for kind in KINDS:
+                bundles[kind] = paths[kind].replace('.yml', '.cqb')
+                compile_clue_set(paths[kind], bundles[kind], size)
+        for kind in KINDS:
+            # Load some other set first, loading the current one again does nothing
+            screen.load_clue_set(paths['text' if kind != 'text' else 'code'])
+            path = bundles[kind] if temperature == 'bundle' else paths[kind]
+            results['load_clue_set.%s.%s' % (kind, temperature)] = [timed(screen.load_clue_set, path)]
+            results['materialize.%s.%s' % (kind, temperature)] = [timed(asset.load) for column in screen.clues for asset in column]
+    return results
+
+
+def bench_frames(simulation, paths, repeat):
+    """Screen.update in every state, redrawing everything and nothing."""
+    screen = simulation.screen
+    game = simulation.game
+    screen.load_clue_set(paths['text'])
+    results = {}
+
+    def measure(state):
+        assert STATES[screen.state] == state, STATES[screen.state]
+        # Wait for the assets being loaded in the background, the loader works in order
+        screen.loader.submit(lambda: None).result()
+        simulation.step()
+
+        full = []
+        idle = []
+        for i in range(repeat):
+            screen.invalidate()
+            full.append(timed(screen.update, game))
+            idle.append(timed(screen.update, game))
+        results['update.%s.full' % state] = full
+        results['update.%s.idle' % state] = idle
+
+    measure('CHOOSING')
+    board = []
+    for i in range(repeat):
+        screen.invalidate_board()
+        board.append(timed(screen.update, game))
+    results['update.CHOOSING.board'] = board
+
+    simulation.step(simulation.click(0, 0))
+    measure('DISPLAY_CLUE')
+    screen.input.push(0, 'benchmark')
+    simulation.step()
+    measure('RESPONDING')
+    simulation.step(simulation.key('j'))
+    measure('DISPLAY_QUESTION')
+    for x in range(game.columns):
+        for y in range(game.rows):
+            game.set_field('board', [x, y], -1)
+    simulation.step(simulation.key('space'))
+    measure('SCOREBOARD')
+    simulation.step(simulation.key('space'))
+    return results
+
+
+def bench_history(simulation, repeat):
+    """Saving an action and undoing and redoing it with a growing history."""
+    game = simulation.game
+    results = {}
+    actions = 0
+
+    def act():
+        x, y = actions % game.columns, actions // game.columns % game.rows
+        game.sel = (x, y)
+        game.responding = actions % game.players
+        if actions % 2:
+            game.correct()
+        else:
+            game.wrong()
+
+    game.clear()
+    for size in HISTORY_SIZES:
+        save = []
+        while len(game.undo_history) < size:
+            start = perf_counter()
+            act()
+            save.append(perf_counter() - start)
+            actions = actions + 1
+        results['save_state.%d' % size] = save[-repeat:]
+        results['rollback.%d' % size] = [timed(game.rollback) for i in range(repeat)]
+        results['redo.%d' % size] = [timed(game.redo) for i in range(repeat)]
+    return results
+
+
+def frame(presses):
+    """A frame of the framed serial protocol."""
+    body = bytes([len(presses)]) + b''.join(pack('<BI', button, time) for button, time in presses)
+    checksum = 0
+    for b in body:
+        checksum = checksum ^ b
+    return bytes([0xAA]) + body + bytes([checksum])
+
+
+def bench_ring_in(simulation, repeat):
+    """From serial data arriving until the ring-in is decided, and until it is on screen."""
+    screen = simulation.screen
+    game = simulation.game
+    results = { 'ring_in.bytes': [], 'ring_in.framed': [], 'ring_in.frame': [] }
+
+    for protocol in ['bytes', 'framed']:
+        screen.input.framed = protocol == 'framed'
+        screen.input.reset_serial()
+        for i in range(repeat):
+            data = frame([(1, i * 1000)]) if protocol == 'framed' else b'1'
+            start = perf_counter()
+            screen.input.read_serial(data, monotonic())
+            press = screen.input.ring_in(lambda player: True)
+            results['ring_in.' + protocol].append(perf_counter() - start)
+            assert press != None
+
+    screen.input.framed = False
+    game.clear()
+    for i in range(repeat):
+        x, y = i % game.columns, i // game.columns % game.rows
+        simulation.step(simulation.click(x, y))
+        simulation.step()
+        start = perf_counter()
+        screen.input.read_serial(b'1', monotonic())
+        screen.update(game)
+        results['ring_in.frame'].append(perf_counter() - start)
+        assert STATES[screen.state] == 'RESPONDING'
+        game.clear_responded()
+        screen.change_state(STATES.index('CHOOSING'))
+        game.set_field('board', [x, y], None)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every result against baseline and return the regressions."""
+    regressions = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        new = result['median']
+        change = (new - old) / old if old > 0 else 0
+        # Ignore tiny absolute differences, they are mostly noise
+        regressed = change > threshold and new - old > 0.05
+        if regressed:
+            regressions.append(name)
+        print('%-32s %10.3f ms %10.3f ms %+7.1f%%%s' % (name, old, new, change * 100, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description='Measure startup, asset loading, frames, history and ring-in latency.')
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    parser.add_argument('-b', '--baseline', help='compare with the results in this file')
+    parser.add_argument('-t', '--threshold', default=0.2, help='relative slowdown reported as regression', type=float)
+    parser.add_argument('-r', '--repeat', default=50, help='repetitions of every measurement', type=int)
+    parser.add_argument('-W', '--width', default=1920, help='display width', type=int)
+    parser.add_argument('-H', '--height', default=1080, help='display height', type=int)
+    args = parser.parse_args()
+    size = (args.width, args.height)
+
+    with TemporaryDirectory() as directory:
+        paths = write_clue_sets(directory, size)
+        values = {
+            'clue-sets': [paths['text']] + [paths[kind] for kind in KINDS if kind != 'text'],
+            'cache': join(directory, 'cache'),
+            'undo-depth': max(HISTORY_SIZES),
+        }
+
+        results = bench_startup(values, directory, size, max(1, args.repeat // 10))
+
+        environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+        environ['CONFIG_FILE'] = write_config(values, directory)
+        simulation = Simulation(size)
+
+        results.update(bench_assets(simulation, paths, size))
+        results.update(bench_frames(simulation, paths, args.repeat))
+        results.update(bench_history(simulation, args.repeat))
+        results.update(bench_ring_in(simulation, args.repeat))
+        simulation.game.journal.close()
+
+    results = {
+        'format': FORMAT,
+        'time': datetime.now(timezone.utc).isoformat(),
+        'platform': platform(),
+        'python': python_version(),
+        'pygame': pygame.version.ver,
+        'size': list(size),
+        'results': { name: summary(samples) for name, samples in results.items() },
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            dump(results, f, indent=2)
+    else:
+        for name, result in results['results'].items():
+            print('%-32s median %10.3f ms  p95 %10.3f ms  n=%d' % (name, result['median'], result['p95'], result['n']))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Clue quiz
+# Copyright (C) 2018-2023  Luca Schmid
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from argparse import ArgumentParser
+from PIL import Image
+from time import perf_counter
+import pygame
+
+from cluequiz.surface import load_image
+
+def load_unconverted(name, max_size):
+    """The image pipeline as it used to be: no conversion to the display format."""
+    im = Image.open(name)
+    im.thumbnail(max_size)
+    return pygame.image.fromstring(im.tobytes('raw', im.mode), im.size, im.mode)
+
+def measure(display, surface, frames):
+    start = perf_counter()
+    for _ in range(frames):
+        display.blit(surface, (0, 0))
+    return (perf_counter() - start) / frames * 1000
+
+def main():
+    parser = ArgumentParser(description='Compare the per frame blit time of an image clue before and after conversion to the display format.')
+    parser.add_argument('-f', '--frames', default=500, help='number of blits to average', type=int)
+    parser.add_argument('-W', '--width', default=1920, help='display width', type=int)
+    parser.add_argument('-H', '--height', default=1080, help='display height', type=int)
+    parser.add_argument('image', help='path to image')
+    args = parser.parse_args()
+
+    pygame.display.init()
+    display = pygame.display.set_mode((args.width, args.height))
+    max_size = (args.width, args.height * 6 // 7)
+
+    before = measure(display, load_unconverted(args.image, max_size), args.frames)
+    after = measure(display, load_image(args.image, max_size), args.frames)
+    print('before: %.3f ms/frame' % before)
+    print('after:  %.3f ms/frame' % after)
+
+if __name__ == '__main__':
+    main()
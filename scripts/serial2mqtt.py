@@ -22,6 +22,8 @@ from time import sleep
 import serial
 
 TOPIC = 'cluequiz/pressed_button'
+MIN_BACKOFF = 0.2 # seconds
+MAX_BACKOFF = 5
 
 class Serial:
     def __init__(self, port, baud):
@@ -36,21 +38,25 @@ class Serial:
             return
 
         try:
-            self.serial = serial.Serial(self.port, self.baud, timeout=0)
+            self.serial = serial.Serial(self.port, self.baud, timeout=0.1)
         except serial.SerialException:
             pass
 
     def read(self):
+        backoff = MIN_BACKOFF
         self.open()
 
         while not self.terminated:
             if not self.serial:
-                sleep(200)
+                sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
                 self.open()
+                continue
+            backoff = MIN_BACKOFF
 
             try:
                 b = self.serial.read()
-            except serial.SerialException:
+            except (serial.SerialException, OSError):
                 self.serial = None
                 continue
 
@@ -97,27 +103,20 @@ def main():
         if terminate:
             break
 
-        match b:
-            case b'1':
-                button = '1'
-            case b'2':
-                button = '2'
-            case b'3':
-                button = '3'
-            case b'4':
-                button = '4'
-            case _:
-                continue
+        # Buttons 1 to 9, clue quiz ignores those of players it does not have
+        if b not in [str(i).encode() for i in range(1, 10)]:
+            continue
+        button = b.decode()
 
         retry = True
-        backoff = 200
+        backoff = MIN_BACKOFF
         while retry and not terminate:
             try:
                 c.publish(TOPIC, button).wait_for_publish()
                 retry = False
             except:
                 sleep(backoff)
-                backoff *= 2
+                backoff = min(backoff * 2, MAX_BACKOFF)
 
 if __name__ == '__main__':
     main()
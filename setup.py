@@ -5,7 +5,7 @@ setup(
     packages=['cluequiz'],
     include_package_data=True,
     install_requires=[
-        'pygame',
+        'pygame>=2.0.1',
         'pyyaml',
         'pyserial',
         'Pillow',